@@ -1,20 +1,46 @@
 """food2vec model loading, ingredient embedding, and vector operations."""
 
 import re
-from typing import List, Optional
+from functools import lru_cache
+from typing import Dict, List, Optional
 
 import numpy as np
-from food2vec.semantic_nutrition import Estimator
 
 EMBEDDING_DIM = 300  # food2vec uses 300-dim vectors
+EMBED_CACHE_SIZE = 8192  # per-model memo of vocab vector lookups
+
+_PAREN_RE = re.compile(r"\s*\(.*?\)\s*")
+_WS_RE = re.compile(r"\s+")
 
 
 class FoodVectorModel:
     """Wraps the food2vec Estimator for ingredient-level embeddings."""
 
     def __init__(self) -> None:
+        # Imported here: food2vec pulls in pandas (~0.4s), which callers that
+        # only need normalize_dish_name or the vector helpers shouldn't pay
+        from food2vec.semantic_nutrition import Estimator
+
         self._estimator = Estimator(demo_warning=False)
         self._vocab = set(self._estimator.embedding_dictionary.keys())
+        # Per-instance memo (lru_cache on the method itself would pin every
+        # model in a class-level cache)
+        self._lookup = lru_cache(maxsize=EMBED_CACHE_SIZE)(self._lookup_uncached)
+
+    def _lookup_uncached(self, w: str) -> Optional[np.ndarray]:
+        vec = self._estimator.embedding_dictionary.get(w)
+        if vec is None:
+            return None
+        if " " in w:
+            # Estimator.embed sums the per-token vectors of multi-word keys
+            # rather than using the key's own entry; keep cached embeddings
+            # consistent with it
+            vec = self._estimator.embed(w, initial=True)
+            if not vec.any():
+                return None
+        vec = np.asarray(vec, dtype=np.float32)
+        vec.flags.writeable = False  # shared between cache hits
+        return vec
 
     @property
     def vocab_size(self) -> int:
@@ -26,12 +52,13 @@ class FoodVectorModel:
     def get_vector(self, word: str) -> Optional[np.ndarray]:
         """Get embedding for a single word. Returns None if not in vocab."""
         w = word.lower().strip()
-        if w in self._vocab:
-            return self._estimator.embed(w)
+        vec = self._lookup(w)
+        if vec is not None:
+            return vec
         # Try individual tokens for multi-word ingredients
         tokens = w.split()
         if len(tokens) > 1:
-            vecs = [self._estimator.embed(t) for t in tokens if t in self._vocab]
+            vecs = [v for v in map(self._lookup, tokens) if v is not None]
             if vecs:
                 return np.mean(vecs, axis=0)
         return None
@@ -39,34 +66,105 @@ class FoodVectorModel:
     def embed_ingredients(self, ingredients: List[str]) -> Optional[np.ndarray]:
         """Average the vectors of all recognized ingredients.
 
-        Returns None if no ingredients have vectors.
+        Each ingredient contributes one vector (multi-word ingredients not in
+        the vocab use the mean of their known tokens, as in get_vector). All
+        token vectors are stacked once and reduced per ingredient with
+        np.add.reduceat. Returns None if no ingredients have vectors.
         """
-        vecs = []
+        rows: List[np.ndarray] = []
+        counts: List[int] = []
         for ing in ingredients:
-            v = self.get_vector(ing)
-            if v is not None:
-                vecs.append(v)
-        if not vecs:
+            w = ing.lower().strip()
+            vec = self._lookup(w)
+            if vec is not None:
+                known = [vec]
+            else:
+                parts = w.split()
+                known = [v for v in map(self._lookup, parts) if v is not None] if len(parts) > 1 else []
+            if known:
+                rows.extend(known)
+                counts.append(len(known))
+        if not rows:
             return None
-        return np.mean(vecs, axis=0).astype(np.float32)
+        stacked = np.stack(rows)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        per_ing = np.add.reduceat(stacked, offsets, axis=0) / np.asarray(counts)[:, None]
+        return per_ing.mean(axis=0).astype(np.float32)
+
+
+class DishEmbeddingStore:
+    """Dish embeddings kept as one contiguous (N, EMBEDDING_DIM) float32 matrix.
+
+    Built once from the dish cache with rows L2-normalized, so scoring a
+    query against every dish is a single matrix_normed @ query.
+    """
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self._index: Dict[str, int] = {}
+        self.matrix_normed = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
 
+    @classmethod
+    def from_dish_cache(cls, dish_cache: Dict[str, Optional[Dict]]) -> "DishEmbeddingStore":
+        """Build a store from a {normalized_name: dish dict} cache.
 
+        All embeddings are converted to float32 and L2-normalized in one
+        batch.
+        """
+        store = cls()
+        names = [n for n, data in dish_cache.items() if data and data.get("embedding")]
+        if not names:
+            return store
+        mat = np.asarray([dish_cache[n]["embedding"] for n in names], dtype=np.float32)
+        norms = np.sqrt(np.einsum("ij,ij->i", mat, mat))
+        mat /= np.where(norms > 0, norms, 1.0)[:, None]
+        store.names = names
+        store._index = {n: i for i, n in enumerate(names)}
+        store.matrix_normed = np.ascontiguousarray(mat)
+        return store
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    def rows_of(self, names: List[str]) -> np.ndarray:
+        """Row index for each name, -1 where the dish has no embedding."""
+        get = self._index.get
+        return np.fromiter((get(n, -1) for n in names), dtype=np.intp, count=len(names))
+
+    def similarities(self, query: List[float]) -> np.ndarray:
+        """Cosine similarity of query against every stored dish, in row order."""
+        q = _as_f32(query)
+        q_norm = np.sqrt(np.vdot(q, q))
+        if q_norm == 0:
+            return np.zeros(len(self.names), dtype=np.float32)
+        return self.matrix_normed @ (q / q_norm)
+
+
+@lru_cache(maxsize=EMBED_CACHE_SIZE)
 def normalize_dish_name(name: str) -> str:
     """Normalize a dish name for cache keying.
 
     Strips Chinese translations in parens, lowercases, collapses whitespace.
     """
-    name = re.sub(r"\s*\(.*?\)\s*", "", name)
-    return re.sub(r"\s+", " ", name.strip().lower())
+    name = _PAREN_RE.sub("", name)
+    return _WS_RE.sub(" ", name.strip().lower())
+
+
+def _as_f32(x) -> np.ndarray:
+    if isinstance(x, np.ndarray) and x.dtype == np.float32:
+        return x
+    return np.asarray(x, dtype=np.float32)
 
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
-    """Cosine similarity between two vectors."""
-    a_arr = np.array(a, dtype=np.float32)
-    b_arr = np.array(b, dtype=np.float32)
-    dot = np.dot(a_arr, b_arr)
-    norm_a = np.linalg.norm(a_arr)
-    norm_b = np.linalg.norm(b_arr)
-    if norm_a == 0 or norm_b == 0:
+    """Cosine similarity between two vectors (lists or float32 arrays)."""
+    a_arr = _as_f32(a)
+    b_arr = _as_f32(b)
+    den_sq = np.vdot(a_arr, a_arr) * np.vdot(b_arr, b_arr)
+    if den_sq == 0:
         return 0.0
-    return float(dot / (norm_a * norm_b))
+    return float(np.dot(a_arr, b_arr) / np.sqrt(den_sq))
+
@@ -1,21 +1,53 @@
 """LLM-based ingredient and attribute extraction from dish names using Groq."""
 
+import asyncio
 import json
 import os
-from typing import Dict, List
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from openai import OpenAI
+from openai import AsyncOpenAI, BadRequestError
 
-BATCH_SIZE = 10
+from food_embeddings import normalize_dish_name
 
-VALID_FLAVORS = {"savory", "sweet", "spicy", "sour", "umami", "mild", "smoky", "tangy", "rich", "fresh"}
-VALID_METHODS = {"fried", "grilled", "baked", "steamed", "stir-fried", "roasted", "braised", "raw", "sauteed", "smoked"}
-VALID_CUISINES = {"chinese", "japanese", "korean", "indian", "mexican", "italian", "american", "mediterranean", "thai", "vietnamese", "french", "middle-eastern", "other"}
-VALID_DIETARY = {"vegetarian", "vegan", "gluten-free", "dairy-free", "halal", "contains-nuts", "contains-shellfish"}
-VALID_DISH_TYPES = {"main", "side", "condiment", "beverage", "dessert"}
+try:
+    import orjson
 
-SYSTEM_PROMPT = """You are a culinary expert. Given a list of dish names, extract attributes for each dish as a JSON object mapping dish name to an object with these fields:
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
 
+    _json_loads = orjson.loads
+except ImportError:  # orjson is an optional speedup
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+# Batches are packed to an estimated token budget (prompt names + the JSON
+# the model writes back for them) instead of a fixed dish count
+BATCH_TOKEN_BUDGET = 2400
+OUTPUT_TOKENS_PER_DISH = 90  # approx. tokens of attribute JSON per dish
+MAX_BATCH_ITEMS = 30
+MAX_CONCURRENCY = 4  # in-flight Groq requests; keeps us under the RPM limit
+# SDK-level retries for 429/5xx/timeouts: exponential backoff with jitter,
+# honouring Retry-After, so one transient error doesn't blank a whole batch
+LLM_MAX_RETRIES = 5
+# Client-side throttle applied before each request, so bursts wait locally
+# instead of bouncing off Groq's 429s. 30 RPM is Groq's lowest per-model
+# limit; the token limit depends on the account tier, so it's off unless set.
+DEFAULT_GROQ_RPM = 30
+
+VALID_FLAVORS = frozenset(map(sys.intern, ("savory", "sweet", "spicy", "sour", "umami", "mild", "smoky", "tangy", "rich", "fresh")))
+VALID_METHODS = frozenset(map(sys.intern, ("fried", "grilled", "baked", "steamed", "stir-fried", "roasted", "braised", "raw", "sauteed", "smoked")))
+VALID_CUISINES = frozenset(map(sys.intern, ("chinese", "japanese", "korean", "indian", "mexican", "italian", "american", "mediterranean", "thai", "vietnamese", "french", "middle-eastern", "other")))
+VALID_DIETARY = frozenset(map(sys.intern, ("vegetarian", "vegan", "gluten-free", "dairy-free", "halal", "contains-nuts", "contains-shellfish")))
+VALID_DISH_TYPES = frozenset(map(sys.intern, ("main", "side", "condiment", "beverage", "dessert")))
+
+# Kept byte-for-byte constant (no interpolation) and always sent as the first
+# message: Groq caches prompts by exact prefix, so every batch after the first
+# reuses the cached system tokens. Per-batch data goes only in the user turn.
+SYSTEM_PROMPT = """You are a culinary expert. Given a list of dish names, extract attributes for each dish. Return a JSON object {"dishes": [...]} with one entry per input dish, each an object with these fields:
+
+- "name": the dish name exactly as given
 - "ingredients": array of lowercase ingredient names (proteins, vegetables, grains, sauces, spices). Keep 1-2 words each.
 - "flavor_profiles": array from: savory, sweet, spicy, sour, umami, mild, smoky, tangy, rich, fresh
 - "cooking_methods": array from: fried, grilled, baked, steamed, stir-fried, roasted, braised, raw, sauteed, smoked
@@ -26,42 +58,149 @@ SYSTEM_PROMPT = """You are a culinary expert. Given a list of dish names, extrac
 Example input: ["Sweet Chili Chicken Drumsticks", "Tofu & Vegetable Lo Mein", "French Fries"]
 Example output:
 {
-  "Sweet Chili Chicken Drumsticks": {
-    "ingredients": ["chicken", "chili", "sugar", "garlic", "soy sauce"],
-    "flavor_profiles": ["sweet", "spicy", "savory"],
-    "cooking_methods": ["fried"],
-    "cuisine_type": "chinese",
-    "dietary_attrs": [],
-    "dish_type": "main"
-  },
-  "Tofu & Vegetable Lo Mein": {
-    "ingredients": ["tofu", "noodles", "vegetables", "soy sauce", "sesame oil"],
-    "flavor_profiles": ["savory", "umami"],
-    "cooking_methods": ["stir-fried"],
-    "cuisine_type": "chinese",
-    "dietary_attrs": ["vegetarian"],
-    "dish_type": "main"
-  },
-  "French Fries": {
-    "ingredients": ["potato", "oil", "salt"],
-    "flavor_profiles": ["savory"],
-    "cooking_methods": ["fried"],
-    "cuisine_type": "american",
-    "dietary_attrs": ["vegetarian", "vegan", "dairy-free"],
-    "dish_type": "side"
-  }
+  "dishes": [
+    {
+      "name": "Sweet Chili Chicken Drumsticks",
+      "ingredients": ["chicken", "chili", "sugar", "garlic", "soy sauce"],
+      "flavor_profiles": ["sweet", "spicy", "savory"],
+      "cooking_methods": ["fried"],
+      "cuisine_type": "chinese",
+      "dietary_attrs": [],
+      "dish_type": "main"
+    },
+    {
+      "name": "Tofu & Vegetable Lo Mein",
+      "ingredients": ["tofu", "noodles", "vegetables", "soy sauce", "sesame oil"],
+      "flavor_profiles": ["savory", "umami"],
+      "cooking_methods": ["stir-fried"],
+      "cuisine_type": "chinese",
+      "dietary_attrs": ["vegetarian"],
+      "dish_type": "main"
+    },
+    {
+      "name": "French Fries",
+      "ingredients": ["potato", "oil", "salt"],
+      "flavor_profiles": ["savory"],
+      "cooking_methods": ["fried"],
+      "cuisine_type": "american",
+      "dietary_attrs": ["vegetarian", "vegan", "dairy-free"],
+      "dish_type": "side"
+    }
+  ]
 }
 
 Return ONLY the JSON object, no other text."""
 
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+SYSTEM_PROMPT_TOKENS = len(SYSTEM_PROMPT) // 4  # rough, for rate limiting
+
+
+def _enum_array(valid: frozenset) -> Dict[str, Any]:
+    return {"type": "array", "items": {"type": "string", "enum": sorted(valid)}}
+
+
+# One fixed schema for every batch, so it stays part of the cacheable request
+# prefix. Dishes come back as a list and are matched to the batch by name.
+# The model is constrained to the same enums that _validate_attrs enforces.
+DISH_ATTRS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "ingredients": {"type": "array", "items": {"type": "string"}},
+        "flavor_profiles": _enum_array(VALID_FLAVORS),
+        "cooking_methods": _enum_array(VALID_METHODS),
+        "cuisine_type": {"type": "string", "enum": sorted(VALID_CUISINES)},
+        "dietary_attrs": _enum_array(VALID_DIETARY),
+        "dish_type": {"type": "string", "enum": sorted(VALID_DISH_TYPES)},
+    },
+    "required": [
+        "name", "ingredients", "flavor_profiles", "cooking_methods",
+        "cuisine_type", "dietary_attrs", "dish_type",
+    ],
+    "additionalProperties": False,
+}
+
+RESPONSE_FORMAT: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "dish_attrs",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"dishes": {"type": "array", "items": DISH_ATTRS_SCHEMA}},
+            "required": ["dishes"],
+            "additionalProperties": False,
+        },
+    },
+}
+# The schema is sent with every request, so it counts toward the token budget
+RESPONSE_FORMAT_TOKENS = len(json.dumps(RESPONSE_FORMAT)) // 4
+
+
+def _parse_response(parsed: Any) -> Dict[str, Any]:
+    """Map the model's {"dishes": [...]} reply to {name: attrs}.
+
+    A name-keyed object (the json_object fallback may still produce one) is
+    returned as is.
+    """
+    if not isinstance(parsed, dict):
+        return {}
+    dishes = parsed.get("dishes")
+    if isinstance(dishes, list):
+        return {d["name"]: d for d in dishes if isinstance(d, dict) and isinstance(d.get("name"), str)}
+    return parsed
+
 
-def _make_client() -> OpenAI:
-    return OpenAI(
+def _make_client() -> AsyncOpenAI:
+    return AsyncOpenAI(
         api_key=os.environ["GROQ_API_KEY"],
         base_url="https://api.groq.com/openai/v1/",
+        max_retries=LLM_MAX_RETRIES,
     )
 
 
+def _is_context_overflow(e: BadRequestError) -> bool:
+    return getattr(e, "code", None) == "context_length_exceeded" or "context_length" in str(e)
+
+
+def _estimate_tokens(name: str) -> int:
+    """Rough token cost of one dish: its name in and out (~4 chars/token) + attrs."""
+    name_tokens = (len(name) + 3) // 4 + 2
+    return 2 * name_tokens + OUTPUT_TOKENS_PER_DISH
+
+
+def _pack_batches(
+    names: List[str],
+    max_tokens: int = BATCH_TOKEN_BUDGET,
+    max_items: int = MAX_BATCH_ITEMS,
+) -> List[List[str]]:
+    """Greedily pack names into batches that fit the estimated token budget."""
+    batches: List[List[str]] = []
+    current: List[str] = []
+    used = 0
+    for name in names:
+        cost = _estimate_tokens(name)
+        if current and (used + cost > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], 0
+        current.append(name)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _enum_value(value: Any) -> str:
+    """Lowercase and intern an enum candidate so set lookups can match by identity."""
+    return sys.intern(str(value).strip().lower())
+
+
+def _enum_list(values: Any, valid: frozenset) -> List[str]:
+    if not isinstance(values, list):
+        return []
+    return [v for v in map(_enum_value, values) if v in valid]
+
+
 def _validate_attrs(raw: dict) -> dict:
     """Validate and sanitize extracted dish attributes against enum sets."""
     ingredients = raw.get("ingredients", [])
@@ -69,14 +208,14 @@ def _validate_attrs(raw: dict) -> dict:
         ingredients = []
     ingredients = [str(x).lower().strip() for x in ingredients if x]
 
-    flavor_profiles = [f for f in raw.get("flavor_profiles", []) if f in VALID_FLAVORS]
-    cooking_methods = [m for m in raw.get("cooking_methods", []) if m in VALID_METHODS]
-    cuisine_type = raw.get("cuisine_type", "other")
+    flavor_profiles = _enum_list(raw.get("flavor_profiles"), VALID_FLAVORS)
+    cooking_methods = _enum_list(raw.get("cooking_methods"), VALID_METHODS)
+    cuisine_type = _enum_value(raw.get("cuisine_type") or "other")
     if cuisine_type not in VALID_CUISINES:
         cuisine_type = "other"
-    dietary_attrs = [d for d in raw.get("dietary_attrs", []) if d in VALID_DIETARY]
+    dietary_attrs = _enum_list(raw.get("dietary_attrs"), VALID_DIETARY)
 
-    dish_type = raw.get("dish_type", "main")
+    dish_type = _enum_value(raw.get("dish_type") or "main")
     if dish_type not in VALID_DISH_TYPES:
         dish_type = "main"
 
@@ -90,36 +229,194 @@ def _validate_attrs(raw: dict) -> dict:
     }
 
 
-def extract_dish_attributes_batch(dish_names: List[str]) -> Dict[str, Dict]:
-    """Extract ingredients and attributes for multiple dishes via LLM.
+# Common dining-hall staples with unambiguous attributes; these bypass the LLM.
+# Rows: (normalized names, ingredients, flavors, methods, cuisine, dietary, dish_type)
+_PLANT = ["vegetarian", "vegan", "gluten-free", "dairy-free", "halal"]
+_VEG_GF = ["vegetarian", "gluten-free"]  # dairy and/or eggs
+_VEG = ["vegetarian"]
+# Plant-based items whose preparation varies: fried items share fryers (and
+# sometimes batter) with breaded and meat dishes, and condiments may contain
+# wheat or alcohol. Only claim what SYSTEM_PROMPT's French Fries example does.
+_VEGAN = ["vegetarian", "vegan", "dairy-free"]
+
+_RULE_ROWS = [
+    # Beverages
+    (["coffee", "hot coffee", "decaf coffee", "iced coffee"], ["coffee"], ["rich"], [], "american", _PLANT, "beverage"),
+    (["hot tea", "iced tea", "green tea", "black tea"], ["tea"], ["mild"], [], "other", _PLANT, "beverage"),
+    (["orange juice"], ["orange"], ["sweet", "fresh"], ["raw"], "american", _PLANT, "beverage"),
+    (["apple juice"], ["apple"], ["sweet"], [], "american", _PLANT, "beverage"),
+    (["cranberry juice"], ["cranberry"], ["sweet", "tangy"], [], "american", _PLANT, "beverage"),
+    (["lemonade"], ["lemon", "sugar"], ["sweet", "sour"], [], "american", _PLANT, "beverage"),
+    (["milk", "whole milk", "skim milk", "2% milk", "1% milk"], ["milk"], ["mild"], [], "american", ["vegetarian", "gluten-free", "halal"], "beverage"),
+    (["chocolate milk"], ["milk", "chocolate"], ["sweet"], [], "american", ["vegetarian", "gluten-free"], "beverage"),
+    (["soy milk"], ["soy milk"], ["mild"], [], "other", _PLANT, "beverage"),
+    (["hot chocolate"], ["chocolate", "milk", "sugar"], ["sweet", "rich"], [], "american", _VEG_GF, "beverage"),
+    # Fruit
+    (["apple", "apples", "whole apples"], ["apple"], ["sweet", "fresh"], ["raw"], "american", _PLANT, "side"),
+    (["banana", "bananas", "whole bananas"], ["banana"], ["sweet", "fresh"], ["raw"], "american", _PLANT, "side"),
+    (["orange", "oranges", "whole oranges"], ["orange"], ["sweet", "fresh"], ["raw"], "american", _PLANT, "side"),
+    (["fresh fruit", "fruit salad", "fresh fruit salad", "fruit cup"], ["melon", "pineapple", "grapes"], ["sweet", "fresh"], ["raw"], "american", _PLANT, "side"),
+    (["grapes"], ["grapes"], ["sweet", "fresh"], ["raw"], "american", _PLANT, "side"),
+    (["cantaloupe", "honeydew", "honeydew melon", "watermelon"], ["melon"], ["sweet", "fresh"], ["raw"], "american", _PLANT, "side"),
+    (["pineapple", "fresh pineapple"], ["pineapple"], ["sweet", "fresh"], ["raw"], "american", _PLANT, "side"),
+    (["strawberries", "mixed berries"], ["strawberry"], ["sweet", "fresh"], ["raw"], "american", _PLANT, "side"),
+    # Grains and potatoes
+    (["white rice", "steamed white rice", "steamed rice", "jasmine rice", "steamed jasmine rice"], ["rice"], ["mild"], ["steamed"], "other", _PLANT, "side"),
+    (["brown rice", "steamed brown rice"], ["brown rice"], ["mild"], ["steamed"], "other", _PLANT, "side"),
+    (["french fries", "fries", "crinkle cut fries", "shoestring fries"], ["potato", "oil", "salt"], ["savory"], ["fried"], "american", _VEGAN, "side"),
+    (["sweet potato fries"], ["sweet potato", "oil", "salt"], ["savory", "sweet"], ["fried"], "american", _VEGAN, "side"),
+    (["tater tots"], ["potato", "oil", "salt"], ["savory"], ["fried"], "american", _VEGAN, "side"),
+    (["hash browns", "hashbrowns", "home fries"], ["potato", "oil", "onion"], ["savory"], ["fried"], "american", _VEGAN, "side"),
+    (["baked potato", "baked potatoes"], ["potato"], ["mild"], ["baked"], "american", _PLANT, "side"),
+    (["mashed potatoes"], ["potato", "butter", "milk"], ["savory", "rich"], [], "american", _VEG_GF, "side"),
+    (["oatmeal"], ["oats"], ["mild"], [], "american", _VEG, "main"),
+    (["grits"], ["corn", "butter"], ["mild", "savory"], [], "american", _VEG_GF, "side"),
+    # Breakfast
+    (["scrambled eggs", "cage free scrambled eggs"], ["egg", "butter"], ["savory", "mild"], ["sauteed"], "american", ["vegetarian", "gluten-free", "halal"], "main"),
+    (["hard boiled eggs", "hard-boiled eggs", "hard cooked eggs"], ["egg"], ["mild"], [], "american", ["vegetarian", "gluten-free", "dairy-free", "halal"], "side"),
+    (["bacon", "crispy bacon"], ["pork", "salt"], ["savory", "smoky"], ["fried"], "american", ["dairy-free"], "side"),
+    (["pancakes", "buttermilk pancakes"], ["flour", "milk", "egg"], ["sweet"], ["baked"], "american", _VEG, "main"),
+    (["waffles", "belgian waffles"], ["flour", "milk", "egg"], ["sweet"], ["baked"], "american", _VEG, "main"),
+    (["french toast"], ["bread", "egg", "milk", "cinnamon"], ["sweet"], ["fried"], "american", _VEG, "main"),
+    (["toast", "white toast", "wheat toast"], ["bread"], ["mild"], ["baked"], "american", _VEG, "side"),
+    (["bagels", "plain bagels", "assorted bagels"], ["flour"], ["mild"], ["baked"], "american", _VEG, "side"),
+    (["english muffin", "english muffins"], ["flour"], ["mild"], ["baked"], "american", _VEG, "side"),
+    # Vegetables
+    (["steamed broccoli", "broccoli"], ["broccoli"], ["mild", "fresh"], ["steamed"], "other", _PLANT, "side"),
+    (["steamed carrots"], ["carrot"], ["sweet", "mild"], ["steamed"], "other", _PLANT, "side"),
+    (["steamed green beans", "green beans"], ["green beans"], ["mild", "fresh"], ["steamed"], "other", _PLANT, "side"),
+    (["corn", "steamed corn", "sweet corn"], ["corn"], ["sweet", "mild"], ["steamed"], "american", _PLANT, "side"),
+    (["steamed vegetables", "steamed mixed vegetables", "seasonal vegetables"], ["carrot", "broccoli", "zucchini"], ["mild", "fresh"], ["steamed"], "other", _PLANT, "side"),
+    (["roasted vegetables", "roasted seasonal vegetables"], ["carrot", "zucchini", "pepper", "olive oil"], ["savory"], ["roasted"], "other", _PLANT, "side"),
+    (["garden salad", "side salad", "tossed salad"], ["lettuce", "tomato", "cucumber", "carrot"], ["fresh"], ["raw"], "american", _PLANT, "side"),
+    # Breads and snacks
+    (["dinner rolls", "dinner roll"], ["flour", "butter"], ["mild"], ["baked"], "american", _VEG, "side"),
+    (["garlic bread"], ["bread", "garlic", "butter"], ["savory"], ["baked"], "italian", _VEG, "side"),
+    (["cornbread"], ["cornmeal", "flour", "butter", "egg"], ["sweet"], ["baked"], "american", _VEG, "side"),
+    (["pita bread", "pita"], ["flour"], ["mild"], ["baked"], "middle-eastern", _VEG, "side"),
+    (["tortilla chips"], ["corn", "oil", "salt"], ["savory"], ["fried"], "mexican", _VEGAN, "side"),
+    # Condiments
+    (["ketchup"], ["tomato", "vinegar", "sugar"], ["sweet", "tangy"], [], "american", _PLANT, "condiment"),
+    (["mustard", "yellow mustard", "dijon mustard"], ["mustard", "vinegar"], ["tangy"], [], "american", _VEGAN, "condiment"),
+    (["mayonnaise", "mayo"], ["egg", "oil"], ["rich"], [], "american", ["vegetarian", "gluten-free", "dairy-free"], "condiment"),
+    (["hot sauce", "sriracha"], ["chili", "vinegar", "garlic"], ["spicy", "tangy"], [], "other", _PLANT, "condiment"),
+    (["soy sauce"], ["soy sauce"], ["savory", "umami"], [], "chinese", _VEGAN, "condiment"),
+    (["salsa", "pico de gallo"], ["tomato", "onion", "cilantro", "chili"], ["fresh", "tangy"], ["raw"], "mexican", _PLANT, "condiment"),
+    (["sour cream"], ["cream"], ["sour", "rich"], [], "american", _VEG_GF, "condiment"),
+    (["butter"], ["butter"], ["rich"], [], "american", _VEG_GF, "condiment"),
+    (["maple syrup", "pancake syrup", "syrup"], ["maple syrup"], ["sweet"], [], "american", _PLANT, "condiment"),
+    (["honey"], ["honey"], ["sweet"], [], "american", ["vegetarian", "gluten-free", "dairy-free", "halal"], "condiment"),
+    (["ranch dressing", "ranch"], ["buttermilk", "herbs"], ["rich", "tangy"], [], "american", _VEG_GF, "condiment"),
+    (["bbq sauce", "barbecue sauce"], ["tomato", "vinegar", "sugar"], ["sweet", "smoky", "tangy"], [], "american", [], "condiment"),
+    # Desserts
+    (["chocolate chip cookies", "chocolate chip cookie"], ["flour", "butter", "sugar", "chocolate"], ["sweet"], ["baked"], "american", _VEG, "dessert"),
+    (["brownies", "brownie"], ["chocolate", "flour", "butter", "sugar", "egg"], ["sweet", "rich"], ["baked"], "american", _VEG, "dessert"),
+    (["vanilla ice cream", "chocolate ice cream", "soft serve", "soft serve ice cream"], ["milk", "cream", "sugar"], ["sweet"], [], "american", _VEG_GF, "dessert"),
+]
+
+
+RULES: Dict[str, Dict] = {
+    name: _validate_attrs({
+        "ingredients": ings,
+        "flavor_profiles": flavors,
+        "cooking_methods": methods,
+        "cuisine_type": cuisine,
+        "dietary_attrs": dietary,
+        "dish_type": dish_type,
+    })
+    for names, ings, flavors, methods, cuisine, dietary, dish_type in _RULE_ROWS
+    for name in names
+}
+
 
-    Batches into groups of BATCH_SIZE to stay within token limits.
-    Returns dict mapping dish_name -> {ingredients, flavor_profiles,
-    cooking_methods, cuisine_type, dietary_attrs}.
+class RateLimiter:
+    """Token buckets over requests/minute and tokens/minute.
+
+    acquire(tokens) waits until one request and `tokens` tokens are
+    available, then takes them. A limit of 0 disables that bucket.
     """
-    if not dish_names:
-        return {}
 
-    client = _make_client()
-    model = os.environ.get("GROQ_MODEL", "").strip() or "openai/gpt-oss-120b"
+    def __init__(self, rpm: int = 0, tpm: int = 0) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """Limits from GROQ_RPM / GROQ_TPM (RPM defaults to DEFAULT_GROQ_RPM)."""
+        rpm = os.environ.get("GROQ_RPM", "").strip()
+        tpm = os.environ.get("GROQ_TPM", "").strip()
+        return cls(int(rpm) if rpm else DEFAULT_GROQ_RPM, int(tpm) if tpm else 0)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed, self._last = now - self._last, now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens: int) -> None:
+        if not self.rpm and not self.tpm:
+            return
+        tokens = min(tokens, self.tpm)  # a request larger than the bucket still runs
+        async with self._lock:  # FIFO: waiters are served in arrival order
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.rpm and self._requests < 1:
+                    wait = (1 - self._requests) * 60 / self.rpm
+                if self.tpm and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.rpm:
+                self._requests -= 1
+            if self.tpm:
+                self._tokens -= tokens
+
+
+async def _extract_batch(
+    client: AsyncOpenAI,
+    model: str,
+    batch: List[str],
+    sem: asyncio.Semaphore,
+    limiter: Optional[RateLimiter] = None,
+) -> Tuple[Dict[str, Dict], bool]:
+    """Run one LLM request for a batch of dish names and validate the output.
+
+    A batch that overflows the model's context is split in half and retried.
+    Returns (attrs by name, ok); on failure every name gets empty attrs and ok is False.
+    """
+    user_msg = _json_dumps(batch)
     result: Dict[str, Dict] = {}
+    est_tokens = SYSTEM_PROMPT_TOKENS + RESPONSE_FORMAT_TOKENS + sum(map(_estimate_tokens, batch))
 
-    for i in range(0, len(dish_names), BATCH_SIZE):
-        batch = dish_names[i : i + BATCH_SIZE]
-        user_msg = json.dumps(batch)
+    async def _create(response_format: Dict[str, Any]):
+        if limiter is not None:
+            await limiter.acquire(est_tokens)
+        return await client.chat.completions.create(
+            model=model,
+            messages=[SYSTEM_MESSAGE, {"role": "user", "content": user_msg}],
+            response_format=response_format,
+            temperature=0.1,
+        )
 
+    async with sem:
         try:
-            resp = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_msg},
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.1,
-            )
+            try:
+                resp = await _create(RESPONSE_FORMAT)
+            except BadRequestError as e:
+                if _is_context_overflow(e):
+                    raise
+                # Model (e.g. a GROQ_MODEL override) without structured outputs
+                resp = await _create({"type": "json_object"})
             text = resp.choices[0].message.content or "{}"
-            parsed = json.loads(text)
+            parsed = _parse_response(_json_loads(text))
 
             for name in batch:
                 raw = parsed.get(name, {})
@@ -130,12 +427,96 @@ def extract_dish_attributes_batch(dish_names: List[str]) -> Dict[str, Dict]:
                     result[name] = _validate_attrs(raw)
                 else:
                     result[name] = _validate_attrs({})
+            return result, True
+        except BadRequestError as e:
+            if not (_is_context_overflow(e) and len(batch) > 1):
+                print(f"[ingredient_extractor] LLM batch failed: {e}")
+                return {name: _validate_attrs({}) for name in batch}, False
         except Exception as e:
             print(f"[ingredient_extractor] LLM batch failed: {e}")
-            for name in batch:
-                result[name] = _validate_attrs({})
+            return {name: _validate_attrs({}) for name in batch}, False
+
+    # Context overflow: retry each half (outside the semaphore we just released)
+    mid = len(batch) // 2
+    print(f"[ingredient_extractor] batch of {len(batch)} too long, splitting")
+    (left, ok_left), (right, ok_right) = await asyncio.gather(
+        _extract_batch(client, model, batch[:mid], sem, limiter),
+        _extract_batch(client, model, batch[mid:], sem, limiter),
+    )
+    return {**left, **right}, ok_left and ok_right
+
+
+async def iter_dish_attributes(
+    dish_names: List[str],
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> AsyncIterator[Tuple[str, Dict]]:
+    """Yield (dish_name, attrs) pairs as soon as each name is resolved.
+
+    Names matching RULES come first; the rest are packed into batches of
+    roughly BATCH_TOKEN_BUDGET tokens, with up to max_concurrency batches in
+    flight, and are yielded batch by batch in completion order so callers
+    can process early results while later batches are still generating.
+    """
+    # Duplicate names (same item at several eateries) are extracted once
+    unique = list(dict.fromkeys(dish_names))
+    misses: List[str] = []
+    for name in unique:
+        hit = RULES.get(normalize_dish_name(name))
+        if hit is not None:
+            yield name, hit
+        else:
+            misses.append(name)
+    if len(misses) < len(unique):
+        print(
+            f"[ingredient_extractor] {len(unique) - len(misses)} rule hits, "
+            f"{len(misses)} to LLM"
+        )
+    if not misses:
+        return
 
-    return result
+    model = os.environ.get("GROQ_MODEL", "").strip() or "openai/gpt-oss-120b"
+    sem = asyncio.Semaphore(max_concurrency)
+    limiter = RateLimiter.from_env()
+
+    async with _make_client() as client:
+        tasks = [
+            asyncio.ensure_future(_extract_batch(client, model, b, sem, limiter))
+            for b in _pack_batches(misses)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                part, _ = await next_done
+                for item in part.items():
+                    yield item
+        finally:
+            for t in tasks:
+                t.cancel()
+
+
+async def extract_dish_attributes_batch_async(
+    dish_names: List[str],
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> Dict[str, Dict]:
+    """Extract ingredients and attributes for multiple dishes via LLM.
+
+    Collects iter_dish_attributes into a dict mapping dish_name ->
+    {ingredients, flavor_profiles, cooking_methods, cuisine_type, dietary_attrs}.
+    """
+    if not dish_names:
+        return {}
+    return {
+        name: attrs
+        async for name, attrs in iter_dish_attributes(dish_names, max_concurrency)
+    }
+
+
+def extract_dish_attributes_batch(dish_names: List[str]) -> Dict[str, Dict]:
+    """Synchronous wrapper around extract_dish_attributes_batch_async.
+
+    Must not be called from inside a running event loop; await the async
+    variant there instead.
+    """
+    return asyncio.run(extract_dish_attributes_batch_async(dish_names))
 
 
 def extract_ingredients_batch(dish_names: List[str]) -> Dict[str, List[str]]:
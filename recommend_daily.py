@@ -4,31 +4,70 @@ import hmac
 import os
 import sys
 import json
+import multiprocessing
+import time
 import re
-import smtplib
-from dataclasses import dataclass
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
 from datetime import datetime
 from email.message import EmailMessage
+from functools import lru_cache
 from html import escape
-from typing import Any, Dict, List, Tuple
+from typing import TYPE_CHECKING, Any, DefaultDict, Dict, List, Optional, Tuple
 from urllib.parse import quote
 
 from dotenv import load_dotenv
-from openai import OpenAI
-from playwright.async_api import async_playwright
+
+from food_embeddings import normalize_dish_name
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# playwright, openai/httpx and aiosmtplib are imported inside the functions
+# that use them: each costs 0.1-0.6s to import, and helpers like build_email
+# or generate_unsub_token shouldn't pay for that
 
 load_dotenv()  # no-op when .env is absent (e.g. GitHub Actions)
 
+try:
+    import orjson
+
+    def _json_dumps(obj: Any, sort_keys: bool = False) -> str:
+        """Compact JSON, non-ASCII left as is (dataclasses serialize natively)."""
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode()
+
+    _json_loads = orjson.loads
+except ImportError:  # orjson is an optional speedup
+
+    def _json_dumps(obj: Any, sort_keys: bool = False) -> str:
+        return json.dumps(
+            obj,
+            ensure_ascii=False,
+            sort_keys=sort_keys,
+            separators=(",", ":"),
+            default=asdict,
+        )
+
+    _json_loads = json.loads
+
 try:
     from zoneinfo import ZoneInfo
 except ImportError:
     print("ERROR: zoneinfo not available. Use Python 3.9+.", file=sys.stderr)
     raise
 
+try:  # libuv event loop: cheaper task scheduling for the scrape's many awaits
+    import uvloop
+except ImportError:  # optional speedup; not available on Windows
+    uvloop = None
+
 LOCAL_TZ = ZoneInfo("America/New_York")
 
 EATERY_DENYLIST = {"104West!"}
 PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt.md")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+MENU_CACHE_MAX_AGE = 2 * 3600  # seconds; menus can change during the day
 
 # Map meal title (with " Menu" stripped) to our three buckets
 EVENT_BUCKET = {
@@ -40,6 +79,17 @@ EVENT_BUCKET = {
 }
 
 
+_MENU_SUFFIX_RE = re.compile(r"\s*Menu\s*$")
+
+
+def _meal_name(title: str) -> str:
+    """Strip the " Menu" suffix: "Breakfast Menu" -> "Breakfast"."""
+    title = title.strip()
+    if title.endswith(" Menu"):
+        return title.removesuffix(" Menu").strip()
+    return _MENU_SUFFIX_RE.sub("", title).strip()
+
+
 @dataclass
 class MenuSlice:
     eatery_name: str
@@ -52,188 +102,438 @@ class MenuSlice:
 
 
 def load_prompt() -> str:
+    """prompt.md, re-read only when its mtime changes (one stat per call), so
+    a long-lived process picks up edits without hitting the disk each run."""
+    return _read_prompt(os.stat(PROMPT_PATH).st_mtime_ns)
+
+
+@lru_cache(maxsize=1)
+def _read_prompt(mtime_ns: int) -> str:
+    # Hash is logged so a changed prefix (which defeats provider prompt
+    # caching) shows up in the run log
     with open(PROMPT_PATH, "r", encoding="utf-8") as f:
-        return f.read().strip()
+        prompt = f.read().strip()
+    print(f"  Prompt sha256: {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]}")
+    return prompt
 
 
 MEAL_BUCKETS = ("breakfast_brunch", "lunch", "dinner")
 
 
+SMTP_CONNECTIONS = 3  # parallel Gmail sessions while sending
+EMAIL_BUILD_WORKERS = 4  # processes scoring users and rendering their emails
+BCC_BATCH_SIZE = 50  # recipients per identical fallback email
+
+GOTO_BACKOFF_S = 2  # doubled after each failed navigation
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+PANEL_EXPAND_TIMEOUT_MS = 2000  # max wait for clicked panels to render
+TAB_SWITCH_TIMEOUT_MS = 5000  # max wait for the West card list to re-render
+CARD_LIST_QUIET_MS = 300  # card list counts as settled after this long unchanged
+CHROMIUM_ARGS = ["--disable-dev-shm-usage", "--disable-gpu"]
+# Only DOM text is scraped. Stylesheets stay: panel visibility and the West
+# tab click depend on the Material CSS.
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media"})
+BLOCKED_HOSTS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net")
+
+
+async def _block_unneeded(route: Any) -> None:
+    req = route.request
+    if req.resource_type in BLOCKED_RESOURCE_TYPES or any(h in req.url for h in BLOCKED_HOSTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+def _menu_cache_path(local_dt: datetime) -> str:
+    return os.path.join(CACHE_DIR, f"menus-{local_dt:%Y-%m-%d}.json")
+
+
+def _load_cached_menus(path: str) -> Optional[Dict[str, List[MenuSlice]]]:
+    """Menus scraped earlier today, or None if missing, stale or unreadable."""
+    try:
+        if time.time() - os.path.getmtime(path) > MENU_CACHE_MAX_AGE:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            raw = _json_loads(f.read())
+        return {b: [MenuSlice(**d) for d in raw.get(b, [])] for b in MEAL_BUCKETS}
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _save_cached_menus(path: str, by_bucket: Dict[str, List[MenuSlice]]) -> None:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a concurrent run never reads a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(_json_dumps(by_bucket))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"WARNING: could not write menu cache: {e}", file=sys.stderr)
+
+
 async def scrape_menus(local_dt: datetime) -> Dict[str, List[MenuSlice]]:
+    # Reruns on the same day (e.g. after a failed send) reuse the scrape
+    cache_path = _menu_cache_path(local_dt)
+    # NO_CACHE=1 forces a fresh scrape
+    cached = None if os.environ.get("NO_CACHE") == "1" else _load_cached_menus(cache_path)
+    if cached is not None:
+        print(f"Using cached menus from {cache_path}")
+        return cached
+
+    from playwright.async_api import async_playwright
+
     by_bucket: Dict[str, List[MenuSlice]] = {k: [] for k in MEAL_BUCKETS}
 
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page()
-        # Retry navigation up to 3 times for transient network errors
+        browser = await p.chromium.launch(headless=True, args=CHROMIUM_ARGS)
+        # A service worker would serve requests outside context.route
+        context = await browser.new_context(service_workers="block")
+        await context.route("**/*", _block_unneeded)
+        page = await context.new_page()
+        # Retry navigation up to 3 times for transient network errors and
+        # 5xx/429 responses (goto only raises on network failures)
         for attempt in range(3):
             try:
-                await page.goto(
+                # Readiness is the app-card wait below; networkidle would also
+                # wait out unrelated analytics traffic
+                resp = await page.goto(
                     "https://now.dining.cornell.edu/eateries",
-                    wait_until="networkidle",
+                    wait_until="domcontentloaded",
+                    timeout=20000,
                 )
+                if resp is not None and resp.status in RETRY_STATUSES:
+                    raise RuntimeError(f"HTTP {resp.status}")
                 break
             except Exception as e:
                 if attempt < 2:
                     print(f"WARNING: page.goto attempt {attempt+1} failed: {e}, retrying...", file=sys.stderr)
-                    await asyncio.sleep(3)
+                    await asyncio.sleep(GOTO_BACKOFF_S * 2**attempt)
                 else:
                     raise
 
         # Wait for cards to appear
         await page.wait_for_selector("app-card", timeout=15000)
 
-        # Click the "West" campus tab
+        # Click the "West" campus tab (unless it's already selected) and wait
+        # for the card list to change and then stop changing, so a list that
+        # Angular renders in stages isn't read half-built
         west_tab = page.locator("text=West").first
-        await west_tab.click()
-        await page.wait_for_timeout(1500)
+        if await west_tab.evaluate(_TAB_SELECTED_JS):
+            print("  West tab already selected.")
+        else:
+            before = await page.evaluate(_CARD_SIGNATURE_JS)
+            await west_tab.click()
+            settled = await page.evaluate(
+                _AWAIT_CARDS_SETTLED_JS, [before, CARD_LIST_QUIET_MS, TAB_SWITCH_TIMEOUT_MS]
+            )
+            if not settled:
+                print("WARNING: card list did not change after selecting West", file=sys.stderr)
 
-        cards = await page.locator("app-card").all()
+        # Expand every collapsed meal panel and read every card in a single
+        # round-trip, then parse in Python
+        scraped = await page.evaluate(
+            _EXPAND_AND_EXTRACT_JS, [list(EVENT_BUCKET), PANEL_EXPAND_TIMEOUT_MS]
+        )
+        print(f"  Expanded {scraped['expanded']} meal panel(s).")
+        cards = scraped["cards"]
         for card in cards:
             try:
-                # Extract eatery name
-                name_el = card.locator(".eateries-name a")
-                name = (await name_el.text_content() or "").strip()
-                if not name or name in EATERY_DENYLIST:
-                    continue
-
-                # Extract location
-                location = ""
-                loc_spans = card.locator(".eateries-name span")
-                count = await loc_spans.count()
-                if count > 0:
-                    location = (await loc_spans.last.text_content() or "").strip()
-
-                # Extract description (menu_summary)
-                menu_summary = ""
-                about_el = card.locator(".eateries-about-short")
-                if await about_el.count() > 0:
-                    menu_summary = (await about_el.first.text_content() or "").strip()
-
-                # Check for mat-expansion-panel menus (skip non-dining eateries)
-                panels = await card.locator("mat-expansion-panel").all()
-                if not panels:
-                    continue
-
-                # Accumulate per bucket
-                acc: Dict[str, Dict[str, Any]] = {}
-
-                for panel in panels:
-                    # Extract meal name from panel title
-                    title_el = panel.locator("mat-panel-title")
-                    title_text = (await title_el.text_content() or "").strip()
-                    # Strip " Menu" suffix: "Breakfast Menu" -> "Breakfast"
-                    meal_name = re.sub(r"\s*Menu\s*$", "", title_text).strip()
-
-                    bucket = EVENT_BUCKET.get(meal_name)
-                    if not bucket:
-                        continue
-
-                    # Expand the panel if not already expanded
-                    panel_classes = await panel.get_attribute("class") or ""
-                    if "mat-expanded" not in panel_classes:
-                        await panel.click()
-                        await page.wait_for_timeout(300)
-
-                    # Extract categories
-                    cat_els = await panel.locator(".eateries-menu-category").all()
-                    cats = []
-                    for cel in cat_els:
-                        ct = (await cel.text_content() or "").strip()
-                        if ct:
-                            cats.append(ct)
-
-                    # Extract items (separated by " • ")
-                    item_els = await panel.locator(".eateries-menu-items").all()
-                    items = []
-                    for iel in item_els:
-                        raw = (await iel.text_content() or "").strip()
-                        if raw:
-                            for part in raw.split(" • "):
-                                part = part.strip()
-                                if part:
-                                    items.append(part)
-
-                    if bucket not in acc:
-                        acc[bucket] = {"descs": [], "items": [], "cats": []}
-                    acc[bucket]["descs"].append(meal_name)
-                    acc[bucket]["items"].extend(items)
-                    acc[bucket]["cats"].extend(cats)
-
-                for bucket, d in acc.items():
-                    # Deduplicate while preserving order
-                    seen = set()
-                    uniq_items = []
-                    for x in d["items"]:
-                        if x not in seen:
-                            seen.add(x)
-                            uniq_items.append(x)
-
-                    seen = set()
-                    uniq_cats = []
-                    for x in d["cats"]:
-                        if x not in seen:
-                            seen.add(x)
-                            uniq_cats.append(x)
-
-                    if not uniq_items and not uniq_cats:
-                        continue
-
-                    by_bucket[bucket].append(
-                        MenuSlice(
-                            eatery_name=name,
-                            location=location,
-                            bucket=bucket,
-                            event_descriptions=sorted(set(d["descs"])),
-                            categories=uniq_cats[:40],
-                            items=uniq_items[:120],
-                            menu_summary=menu_summary,
-                        )
-                    )
+                for ms in _card_to_slices(card):
+                    by_bucket[ms.bucket].append(ms)
             except Exception as e:
                 print(f"WARNING: skipped card: {e}", file=sys.stderr)
-                continue
 
+        await context.close()
         await browser.close()
 
+    if any(by_bucket.values()):  # don't pin an empty scrape for two hours
+        _save_cached_menus(cache_path, by_bucket)
     return by_bucket
 
 
-def call_llm(prompt: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    client = OpenAI(
+# Runs in the browser: names of the cards currently shown, joined
+_CARD_SIGNATURE_JS = """
+() => Array.from(document.querySelectorAll("app-card .eateries-name a"),
+                 (a) => a.textContent.trim()).join("|")
+"""
+
+# Runs in the browser: whether the campus tab holding `el` is the selected
+# one, from its ARIA state or an active/selected/checked class
+_TAB_SELECTED_JS = """
+(el) => {
+  const tab = el.closest('[role="tab"], [role="radio"], button, mat-button-toggle, a') || el;
+  return [tab, tab.parentElement].some((n) => n && (
+    ["aria-selected", "aria-pressed", "aria-checked", "aria-current"].some((a) => {
+      const v = n.getAttribute(a);
+      return v !== null && v !== "false";
+    }) ||
+    Array.from(n.classList).some((c) => /(^|-)(active|selected|checked)$/.test(c))
+  ));
+}
+"""
+
+# Runs in the browser: resolve true once the shown cards differ from `before`
+# and then go quietMs without DOM changes, or false after timeoutMs. Woken
+# by DOM mutations rather than polled.
+_AWAIT_CARDS_SETTLED_JS = f"""
+async ([before, quietMs, timeoutMs]) => {{
+  const signature = {_CARD_SIGNATURE_JS.strip()};
+  return await new Promise((resolve) => {{
+    let quiet = null;
+    const finish = (ok) => {{
+      observer.disconnect(); clearTimeout(quiet); clearTimeout(limit); resolve(ok);
+    }};
+    const check = () => {{
+      clearTimeout(quiet);
+      const now = signature();
+      if (now !== "" && now !== before) quiet = setTimeout(() => finish(true), quietMs);
+    }};
+    const observer = new MutationObserver(check);
+    const limit = setTimeout(() => finish(false), timeoutMs);
+    observer.observe(document.body, {{ childList: true, subtree: true, characterData: true }});
+    check();
+  }});
+}}
+"""
+
+# Runs in the browser: click every collapsed panel whose meal is one we
+# bucket, then wait once until they have all rendered content (or time out),
+# woken by DOM mutations inside the clicked panels.
+# Returns the number of panels clicked. Title parsing mirrors _meal_name.
+_EXPAND_PANELS_JS = """
+async ([meals, timeoutMs]) => {
+  const wanted = new Set(meals);
+  const mealName = (t) => t.trim().replace(/\\s*Menu\\s*$/, "").trim();
+  const clicked = [];
+  for (const panel of document.querySelectorAll("app-card mat-expansion-panel:not(.mat-expanded)")) {
+    const title = panel.querySelector("mat-panel-title");
+    if (!title || !wanted.has(mealName(title.textContent || ""))) continue;
+    (panel.querySelector("mat-expansion-panel-header") || panel).click();
+    clicked.push(panel);
+  }
+  const pending = () => clicked.some(
+    (p) => !p.querySelector(".eateries-menu-items, .eateries-menu-category"));
+  if (pending()) {
+    // Re-check on DOM mutations rather than on a timer
+    await new Promise((resolve) => {
+      const done = () => { observer.disconnect(); clearTimeout(timer); resolve(); };
+      const observer = new MutationObserver(() => { if (!pending()) done(); });
+      const timer = setTimeout(done, timeoutMs);
+      for (const p of clicked) observer.observe(p, { childList: true, subtree: true });
+    });
+  }
+  return clicked.length;
+}
+"""
+
+# Runs in the browser: serialize every app-card's fields and menu panels
+_EXTRACT_CARDS_JS = """
+(cards) => cards.map((card) => {
+  const text = (el) => ((el && el.textContent) || "").trim();
+  const locSpans = card.querySelectorAll(".eateries-name span");
+  return {
+    name: text(card.querySelector(".eateries-name a")),
+    location: locSpans.length ? text(locSpans[locSpans.length - 1]) : "",
+    summary: text(card.querySelector(".eateries-about-short")),
+    panels: Array.from(card.querySelectorAll("mat-expansion-panel")).map((panel) => ({
+      title: text(panel.querySelector("mat-panel-title")),
+      cats: Array.from(panel.querySelectorAll(".eateries-menu-category"), text),
+      items: Array.from(panel.querySelectorAll(".eateries-menu-items"), text),
+    })),
+  };
+})
+"""
+
+
+# Runs in the browser: both passes above in one evaluate call
+_EXPAND_AND_EXTRACT_JS = f"""
+async (args) => {{
+  const expanded = await ({_EXPAND_PANELS_JS.strip()})(args);
+  const cards = ({_EXTRACT_CARDS_JS.strip()})(Array.from(document.querySelectorAll("app-card")));
+  return {{ expanded, cards }};
+}}
+"""
+
+
+def _card_to_slices(card: Dict[str, Any]) -> List[MenuSlice]:
+    """Turn one serialized eatery card into MenuSlices (one per meal bucket)."""
+    name = card.get("name", "")
+    if not name or name in EATERY_DENYLIST:
+        return []
+
+    location = card.get("location", "")
+    menu_summary = card.get("summary", "")
+
+    # Skip non-dining eateries (no mat-expansion-panel menus)
+    panels = card.get("panels") or []
+    if not panels:
+        return []
+
+    # Accumulate per bucket
+    acc: DefaultDict[str, Dict[str, List[str]]] = defaultdict(
+        lambda: {"descs": [], "items": [], "cats": []}
+    )
+
+    for panel in panels:
+        meal_name = _meal_name(panel.get("title", ""))
+
+        bucket = EVENT_BUCKET.get(meal_name)
+        if not bucket:
+            continue
+
+        cats = [ct for ct in panel.get("cats", []) if ct]
+
+        # Extract items (separated by " • ")
+        items = [
+            part
+            for raw in panel.get("items", [])
+            for part in map(str.strip, raw.split(" • "))
+            if part
+        ]
+
+        d = acc[bucket]
+        d["descs"].append(meal_name)
+        d["items"].extend(items)
+        d["cats"].extend(cats)
+
+    slices: List[MenuSlice] = []
+    for bucket, d in acc.items():
+        # Deduplicate while preserving order
+        uniq_items = list(dict.fromkeys(d["items"]))
+        uniq_cats = list(dict.fromkeys(d["cats"]))
+
+        if not uniq_items and not uniq_cats:
+            continue
+
+        slices.append(
+            MenuSlice(
+                eatery_name=name,
+                location=location,
+                bucket=bucket,
+                event_descriptions=list(dict.fromkeys(d["descs"])),  # page (meal) order
+                categories=uniq_cats[:40],
+                items=uniq_items[:120],
+                menu_summary=menu_summary,
+            )
+        )
+    return slices
+
+# Everything before the payload is byte-identical across days (the system
+# prompt across buckets too), so provider prefix caching can reuse it; the
+# per-day data always goes last. prompt.md describes all three meals, so each
+# per-bucket request says which single key to return.
+LLM_USER_PREFIX = (
+    'Choose winners for today. The data holds only the "{bucket}" meal; '
+    'return only the "{bucket}" key. Data:\n'
+)
+
+
+LLM_CACHE_DIR = os.path.join(CACHE_DIR, "llm")
+# Picks JSON is ~1k tokens; the rest is headroom for gpt-oss reasoning tokens,
+# which count against the same limit
+LLM_MAX_COMPLETION_TOKENS = 4096
+LLM_TIMEOUT = 30.0  # seconds per request
+LLM_MAX_RETRIES = 3  # SDK retries (backoff with jitter) on 429/5xx/timeouts
+
+
+def _llm_cache_key(model: str, prompt: str, user_msg: str) -> str:
+    return hashlib.sha256("\0".join((model, prompt, user_msg)).encode("utf-8")).hexdigest()
+
+
+def _llm_cache_get(key: str) -> Optional[str]:
+    try:
+        with open(os.path.join(LLM_CACHE_DIR, f"{key}.json"), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _llm_cache_set(key: str, text: str) -> None:
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        with open(os.path.join(LLM_CACHE_DIR, f"{key}.json"), "w", encoding="utf-8") as f:
+            f.write(text)
+    except OSError as e:
+        print(f"WARNING: could not write LLM cache: {e}", file=sys.stderr)
+
+
+@lru_cache(maxsize=1)
+def _groq_client() -> "OpenAI":
+    """Process-wide Groq client; its pooled connection (and TLS session) is
+    reused across calls."""
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        timeout=LLM_TIMEOUT,
+        # Idle sockets outlive the SDK's retry backoff (default expiry is 5s)
+        limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=30),
+    )
+    return OpenAI(
         api_key=os.environ["GROQ_API_KEY"],
         base_url="https://api.groq.com/openai/v1/",
+        http_client=http_client,
+        max_retries=LLM_MAX_RETRIES,
     )
+
+
+def call_llm(prompt: str, bucket: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Ask for one meal bucket's picks; payload holds only that bucket's menus."""
     model = os.environ.get("GROQ_MODEL", "").strip() or "openai/gpt-oss-120b"
 
+    # Responses are deterministic (temperature=0), so a rerun with the same
+    # prompt and menus reuses the stored answer. The user message is built
+    # once; that string is both the cache key input and the message body.
+    user_msg = LLM_USER_PREFIX.format(bucket=bucket) + _json_dumps(payload)
+    cache_key = _llm_cache_key(model, prompt, user_msg)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        try:
+            return _json_loads(cached)
+        except ValueError:
+            pass  # corrupt entry; fall through and overwrite it
+
+    client = _groq_client()
+    # Most of gpt-oss's latency is hidden reasoning; picks don't need much
+    extra: Dict[str, Any] = {}
+    if model.startswith("openai/gpt-oss"):
+        extra["reasoning_effort"] = "low"
+
     resp = client.chat.completions.create(
         model=model,
         messages=[
             {"role": "system", "content": prompt},
             {
                 "role": "user",
-                "content": f"Choose winners for today. Data:\n{json.dumps(payload, ensure_ascii=False)}",
+                "content": user_msg,
             },
         ],
         response_format={"type": "json_object"},
+        temperature=0,
+        max_completion_tokens=LLM_MAX_COMPLETION_TOKENS,
+        **extra,
     )
 
     text = resp.choices[0].message.content
     if not text:
         raise RuntimeError("LLM returned empty response")
-    return json.loads(text)
+    result = _json_loads(text)
+    _llm_cache_set(cache_key, text)
+    return result
 
 
 def sanitize_result(
     result: Any, menus: Dict[str, List[MenuSlice]]
 ) -> Dict[str, Any]:
-    """Validate and fix LLM output: enforce structure, dedupe eateries, cap picks."""
+    """Validate and fix LLM output: enforce structure, drop eateries not
+    serving that meal, dedupe eateries, cap picks."""
     if not isinstance(result, dict):
         result = {}
 
-    valid_eateries: Dict[str, set] = {}
-    for bucket, slices in menus.items():
-        valid_eateries[bucket] = {ms.eatery_name for ms in slices}
+    valid_eateries = {
+        bucket: frozenset(ms.eatery_name for ms in slices) for bucket, slices in menus.items()
+    }
 
     for bucket in MEAL_BUCKETS:
         meal = result.get(bucket)
@@ -246,31 +546,110 @@ def sanitize_result(
             meal["picks"] = []
             continue
 
-        # Deduplicate eateries and ensure each pick has required fields
-        seen: set = set()
-        clean: list = []
+        # Deduplicate eateries (first pick wins; dicts keep insertion order)
+        # and ensure each pick has required fields
+        clean: Dict[str, Dict[str, Any]] = {}
         for p in picks:
             if not isinstance(p, dict):
                 continue
             eatery = p.get("eatery", "")
             if not isinstance(eatery, str) or not eatery:
                 continue
-            if eatery in seen:
+            if eatery in clean or eatery not in valid_eateries.get(bucket, ()):
                 continue
-            seen.add(eatery)
             dishes = p.get("dishes", [])
             if not isinstance(dishes, list):
                 dishes = []
-            clean.append({"eatery": eatery, "dishes": [str(d) for d in dishes]})
+            clean[eatery] = {"eatery": eatery, "dishes": [str(d) for d in dishes]}
+            if len(clean) == 3:
+                break
 
-        meal["picks"] = clean[:3]
+        meal["picks"] = list(clean.values())
 
     return result
 
 
+@lru_cache(maxsize=4)
+def _unsub_hmac(secret: str) -> "hmac.HMAC":
+    """HMAC-SHA256 state keyed with secret; copy() it per message so the
+    padded key is derived once per process, not once per token."""
+    return hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+
 def generate_unsub_token(email: str, secret: str) -> str:
     """Generate an HMAC-SHA256 token for unsubscribe links."""
-    return hmac.new(secret.encode(), email.lower().encode(), hashlib.sha256).hexdigest()
+    h = _unsub_hmac(secret).copy()
+    h.update(email.lower().encode())
+    return h.hexdigest()
+
+
+def generate_unsub_tokens(emails: List[str], secret: str) -> Dict[str, str]:
+    """generate_unsub_token for many emails, keyed by email."""
+    template = _unsub_hmac(secret)
+    tokens: Dict[str, str] = {}
+    for email in emails:
+        h = template.copy()
+        h.update(email.lower().encode())
+        tokens[email] = h.hexdigest()
+    return tokens
+
+
+# Eatery names, locations and dishes are the same strings in every
+# recipient's email; escape each once per run
+_escape_menu_text = lru_cache(maxsize=4096)(escape)
+
+_RATE_UP = escape("&rating=up")
+_RATE_DOWN = escape("&rating=down")
+
+
+def build_loc_map(menus: Dict[str, List[MenuSlice]]) -> Dict[str, str]:
+    """Eatery name -> location, across all buckets."""
+    return {ms.eatery_name: ms.location for lst in menus.values() for ms in lst}
+
+
+def build_rating_link_table(
+    daily_menu_lookup: Dict[int, Dict], date_str_iso: str
+) -> Dict[Tuple[str, str, str], str]:
+    """Map (normalized_name, eatery, bucket) to the escaped recipient-independent
+    tail of its rating URL. Built once per run and shared by every email."""
+    table: Dict[Tuple[str, str, str], str] = {}
+    for menu_id, info in (daily_menu_lookup or {}).items():
+        if not menu_id:
+            continue
+        key = (info.get("normalized", ""), info.get("eatery", ""), info.get("bucket", ""))
+        table[key] = escape(f"&menu_id={menu_id}&date={date_str_iso}")
+    return table
+
+
+# Stand-ins for the recipient's quoted email and token in a shared
+# template; quote() and escape() leave them unchanged
+_EMAIL_SLOT = "cmp-recipient-email-slot"
+_TOKEN_SLOT = "cmp-recipient-token-slot"
+
+
+def fill_email_template(html: str, recipient_email: str, recipient_token: str) -> str:
+    """Personalize HTML built by build_email with the slot placeholders as
+    recipient email/token (and in the unsubscribe URL)."""
+    return html.replace(_EMAIL_SLOT, quote(recipient_email)).replace(_TOKEN_SLOT, recipient_token)
+
+
+_MEAL_SECTIONS = (
+    ("Breakfast / Brunch", "breakfast_brunch"),
+    ("Lunch", "lunch"),
+    ("Dinner", "dinner"),
+)
+
+
+def _pick_badge(rank: int) -> str:
+    color = "#d35400" if rank == 0 else "#7f8c8d"
+    return (
+        f'<span style="background:{color};color:#fff;padding:2px 8px;border-radius:4px;'
+        f'font-size:12px;font-weight:bold;">#{rank+1} Pick</span> '
+    )
+
+
+# build_email shows at most four picks per meal; their badges never change
+_PICK_BADGES = tuple(_pick_badge(rank) for rank in range(4))
 
 
 def build_email(
@@ -281,96 +660,76 @@ def build_email(
     rating_base_url: str = "",
     recipient_email: str = "",
     recipient_token: str = "",
-    daily_menu_lookup: Dict[int, Dict] = None,
-    date_str_iso: str = "",
+    rating_link_table: Optional[Dict[Tuple[str, str, str], str]] = None,
+    loc_map: Optional[Dict[str, str]] = None,
 ) -> Tuple[str, str]:
     date_str = local_dt.strftime("%a, %b %d, %Y")
     subject = f"CMP — West Campus Dining Picks — {date_str}"
 
-    # Location lookup
-    loc: Dict[str, str] = {}
-    for bucket, lst in menus.items():
-        for ms in lst:
-            loc[ms.eatery_name] = ms.location
-
-    # Build reverse lookup: (normalized_name, eatery, bucket) -> daily_menus.id
-    menu_id_lookup: Dict[str, int] = {}
-    if daily_menu_lookup:
-        for menu_id, info in daily_menu_lookup.items():
-            key = f"{info.get('normalized', '')}|{info.get('eatery', '')}|{info.get('bucket', '')}"
-            menu_id_lookup[key] = menu_id
-
-    meal_labels = [
-        ("Breakfast / Brunch", "breakfast_brunch"),
-        ("Lunch", "lunch"),
-        ("Dinner", "dinner"),
-    ]
+    # Location lookup (pass loc_map to share one across recipients)
+    loc = loc_map if loc_map is not None else build_loc_map(menus)
 
-    def _rating_links(dish_name: str, eatery: str, bucket: str) -> str:
-        if not rating_base_url or not recipient_email or not recipient_token or not daily_menu_lookup:
-            return ""
-        from food_embeddings import normalize_dish_name
-        norm = normalize_dish_name(dish_name)
-        key = f"{norm}|{eatery}|{bucket}"
-        menu_id = menu_id_lookup.get(key)
-        if not menu_id:
-            return ""
-        base = (
+    # Per-recipient half of every rating URL, escaped once (escape() is
+    # per-character, so escaped halves concatenate safely)
+    rate_prefix = ""
+    if rating_base_url and recipient_email and recipient_token and rating_link_table:
+        rate_prefix = escape(
             f"{rating_base_url}/api/rate"
             f"?email={quote(recipient_email)}&token={recipient_token}"
-            f"&menu_id={menu_id}&date={date_str_iso}"
         )
+
+    def _rating_links(dish_name: str, eatery: str, bucket: str) -> str:
+        if not rate_prefix:
+            return ""
+        suffix = rating_link_table.get((normalize_dish_name(dish_name), eatery, bucket))
+        if not suffix:
+            return ""
         return (
-            f' <a href="{escape(base + "&rating=up")}" '
+            f' <a href="{rate_prefix}{suffix}{_RATE_UP}" '
             f'style="text-decoration:none;font-size:14px;" title="I like this">&#128077;</a>'
-            f' <a href="{escape(base + "&rating=down")}" '
+            f' <a href="{rate_prefix}{suffix}{_RATE_DOWN}" '
             f'style="text-decoration:none;font-size:14px;" title="Not for me">&#128078;</a>'
         )
 
     def _pick_html(rank: int, pick: Dict[str, Any], bucket: str) -> str:
         raw_name = pick.get("eatery", "")
-        name = escape(raw_name)
+        name = _escape_menu_text(raw_name)
         dishes = pick.get("dishes", [])
-        labels = {0: "#1 Pick", 1: "#2 Pick", 2: "#3 Pick", 3: "#4 Pick"}
-        colors = {0: "#d35400", 1: "#7f8c8d", 2: "#7f8c8d", 3: "#7f8c8d"}
-        label = labels.get(rank, f"#{rank+1} Pick")
-        color = colors.get(rank, "#7f8c8d")
-        location = escape(loc.get(raw_name, ""))
+        badge = _PICK_BADGES[rank]
+        location = _escape_menu_text(loc.get(raw_name, ""))
         loc_line = f'<div style="color:#888;font-size:13px;">{location}</div>' if location else ""
         dishes_line = ""
         if dishes:
             items_html = "".join(
-                f"<li>{escape(d)}{_rating_links(d, raw_name, bucket)}</li>"
+                f"<li>{_escape_menu_text(d)}{_rating_links(d, raw_name, bucket)}</li>"
                 for d in dishes
             )
             dishes_line = f'<ul style="color:#555;font-size:13px;margin:4px 0 0 0;padding-left:20px;">{items_html}</ul>'
         return (
             f'<div style="margin-bottom:10px;">'
-            f'<span style="background:{color};color:#fff;padding:2px 8px;border-radius:4px;'
-            f'font-size:12px;font-weight:bold;">{label}</span> '
+            f'{badge}'
             f'<strong style="font-size:15px;">{name}</strong>'
             f'{loc_line}'
             f'{dishes_line}'
             f'</div>'
         )
 
-    sections_html = ""
-    for title, key in meal_labels:
+    sections: List[str] = []
+    for title, key in _MEAL_SECTIONS:
         obj = result.get(key, {}) if isinstance(result, dict) else {}
         picks = obj.get("picks", [])
-        inner = ""
         if not picks:
             inner = '<p style="color:#999;">No recommendation (no matching menu found).</p>'
         else:
-            for i, p in enumerate(picks[:4]):
-                inner += _pick_html(i, p, key)
-        sections_html += (
+            inner = "".join(_pick_html(i, p, key) for i, p in enumerate(picks[:4]))
+        sections.append(
             f'<div style="margin-bottom:24px;">'
             f'<h2 style="margin:0 0 8px 0;font-size:18px;color:#2c3e50;'
             f'border-bottom:2px solid #e67e22;padding-bottom:4px;">{title}</h2>'
             f'{inner}'
             f'</div>'
         )
+    sections_html = "".join(sections)
 
     # Unsubscribe footer
     unsub_line = ""
@@ -402,21 +761,203 @@ def build_email(
     return subject, html
 
 
-async def main() -> int:
+def _make_message(
+    gmail_user: str, subject: str, body: str, to: str, bcc: Optional[List[str]] = None
+) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = gmail_user
+    msg["To"] = to
+    if bcc:
+        msg["Bcc"] = ", ".join(bcc)
+    msg.set_content("View this email in an HTML-capable client.")
+    msg.add_alternative(body, subtype="html")
+    return msg
+
+
+async def send_emails(
+    queue: "asyncio.Queue[Optional[Tuple[str, EmailMessage]]]",
+    gmail_user: str,
+    gmail_app_password: str,
+) -> None:
+    """Send (label, message) pairs from queue over SMTP_CONNECTIONS parallel
+    Gmail SMTP sessions.
+
+    Each session logs in once and keeps pulling messages, so sending overlaps
+    with the producers still building emails. A session stops at the first
+    None it reads; put one None per session when done. A message Gmail
+    rejects is logged and skipped so its session keeps going; the run fails
+    at the end if any were rejected.
+    """
+    import aiosmtplib
+
+    failed: List[str] = []
+
+    async def worker() -> None:
+        smtp = aiosmtplib.SMTP(hostname="smtp.gmail.com", port=465, use_tls=True, timeout=30)
+        async with smtp:
+            await smtp.login(gmail_user, gmail_app_password)
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                label, msg = item
+                try:
+                    await smtp.send_message(msg)
+                except (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPResponseException) as e:
+                    print(f"WARNING: send to {label} rejected: {e}", file=sys.stderr)
+                    failed.append(label)
+                    continue
+                print(f"  → Sent to {label}")
+
+    await asyncio.gather(*(worker() for _ in range(SMTP_CONNECTIONS)))
+    if failed:
+        raise RuntimeError(f"{len(failed)} email(s) rejected: {', '.join(failed)}")
+
+
+async def _log_outbox(queue: "asyncio.Queue[Optional[Tuple[str, EmailMessage]]]") -> None:
+    """Dry-run stand-in for send_emails: print each queued message's subject
+    and recipients, send none."""
+    while (item := await queue.get()) is not None:
+        msg = item[1]
+        to = ", ".join(filter(None, (msg["To"], msg["Bcc"])))
+        print(f"  → [dry run] would send {msg['Subject']!r} to {to}")
+
+
+# Per-run state shared by every _build_user_email call, set once per worker
+# process by _init_email_worker
+_email_ctx: Dict[str, Any] = {}
+
+
+def _init_email_worker(ctx: Dict[str, Any]) -> None:
+    _email_ctx.update(ctx)
+
+
+def _build_user_email(user: Dict[str, Any]) -> Tuple[str, EmailMessage]:
+    """Recommend and render one user's email. CPU-bound pure Python, so it
+    runs in a worker process (threads would serialize on the GIL)."""
+    from recommendation_engine import generate_recommendations
+
+    ctx = _email_ctx
+    hmac_secret, worker_url = ctx["hmac_secret"], ctx["worker_url"]
+    recipient = user["email"]
+    token = ctx["tokens"].get(recipient, "")
+
+    # Build unsubscribe URL
+    unsub_url = ""
+    if hmac_secret and worker_url:
+        unsub_url = (
+            f"{worker_url}/api/unsubscribe"
+            f"?email={quote(recipient)}&token={token}"
+        )
+
+    # Embedding-based recommendation with hybrid scoring
+    result = generate_recommendations(
+        user["preference_vector"], ctx["menus"], ctx["cached"],
+        flavor_weights=user.get("flavor_weights", {}),
+        method_weights=user.get("method_weights", {}),
+        cuisine_weights=user.get("cuisine_weights", {}),
+        user_dietary=user.get("dietary_restrictions", []),
+        rating_count=user.get("_rating_count", 0),
+        embedding_store=ctx["embedding_store"],
+    )
+    print(f"  {recipient}: embedding-based recommendation", flush=True)
+
+    subject, html = build_email(
+        ctx["local_dt"],
+        result,
+        ctx["menus"],
+        unsubscribe_url=unsub_url,
+        rating_base_url=worker_url,
+        recipient_email=recipient,
+        recipient_token=token,
+        rating_link_table=ctx["rating_link_table"],
+        loc_map=ctx["loc_map"],
+    )
+    return recipient, _make_message(ctx["gmail_user"], subject, html, recipient)
+
+
+def llm_fallback_result(menus: Dict[str, List[MenuSlice]], date_str_iso: str) -> Dict[str, Any]:
+    """Today's LLM picks, shared by every user without a preference vector.
+
+    Buckets are independent, so each meal is its own request, all three in
+    flight at once: the wait is the slowest bucket rather than one response
+    generating picks for every meal. Each bucket is cached separately.
+    """
+    buckets = [b for b in MEAL_BUCKETS if menus.get(b)]
+    if not buckets:  # nothing scraped (holiday, outage): don't pay for a request
+        print("  No menus; skipping LLM fallback recommendation.")
+        return sanitize_result({}, menus)
+    print("  Computing LLM fallback recommendation...")
+    prompt = load_prompt()
+
+    def bucket_picks(bucket: str) -> Any:
+        payload = {
+            "date_local": date_str_iso,
+            "timezone": "America/New_York",
+            "campus_area_filter": "West",
+            "meals": {
+                bucket: [
+                    {
+                        "eatery_name": ms.eatery_name,
+                        "location": ms.location,
+                        "event_descriptions": ms.event_descriptions,
+                        "menu_summary": ms.menu_summary,
+                        "categories": ms.categories,
+                        "items": ms.items,
+                    }
+                    for ms in menus[bucket]
+                ]
+            },
+        }
+        result = call_llm(prompt, bucket, payload)
+        return result.get(bucket) if isinstance(result, dict) else None
+
+    # Built here, not on first use inside the pool: the threads would race
+    # through the lru_cache and each build its own HTTP client
+    _groq_client()
+    with ThreadPoolExecutor(max_workers=len(MEAL_BUCKETS)) as pool:
+        picks = dict(zip(buckets, pool.map(bucket_picks, buckets)))
+    return sanitize_result(picks, menus)
+
+
+async def main(dry_run: bool = False) -> int:
+    """Run the daily pipeline.
+
+    dry_run reads Supabase and renders every email but writes nothing back,
+    makes no Groq requests (dishes without attributes are left out of
+    ranking, fallback picks are empty) and prints each message's subject and
+    recipients instead of opening SMTP sessions.
+    """
+    # Tasks whose coroutine finishes without suspending skip the scheduler
+    # (Python 3.12+; CI runs 3.11, where this is a no-op)
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
     local_dt = datetime.now(LOCAL_TZ)
     date_str_iso = local_dt.strftime("%Y-%m-%d")
 
-    # Step 1: Scrape menus (unchanged)
-    menus = await scrape_menus(local_dt)
-
-    # Step 2: Load food2vec model and Supabase client
-    from food_embeddings import FoodVectorModel, normalize_dish_name
-    from ingredient_extractor import extract_dish_attributes_batch
-    from recommendation_engine import compute_preference_vector, generate_recommendations, infer_attribute_preferences
+    from food_embeddings import DishEmbeddingStore, FoodVectorModel
+    from ingredient_extractor import iter_dish_attributes
+    from recommendation_engine import compute_preference_vector, infer_attribute_preferences
     from supabase_client import SupabaseClient
 
-    model = FoodVectorModel()
+    # Work that doesn't depend on the menus runs in worker threads while
+    # Chromium cold-starts and scrapes (Step 1): food2vec downloads and
+    # indexes its vectors, and the subscriber list is fetched (Step 6). The
+    # fetch gets its own client: db's HTTP session is used on this thread
+    # meanwhile, and it isn't shared across threads.
     db = SupabaseClient()
+    model_task = asyncio.create_task(asyncio.to_thread(FoodVectorModel))
+    users_task = asyncio.create_task(
+        asyncio.to_thread(lambda: SupabaseClient().get_subscribed_users())
+    )
+
+    # Step 1: Scrape menus
+    menus = await scrape_menus(local_dt)
+
+    # Step 2: Load food2vec model
+    model = await model_task
     print(f"food2vec loaded: {model.vocab_size} items in vocabulary.")
 
     # Step 3: Collect all dish names, check Supabase cache
@@ -426,7 +967,8 @@ async def main() -> int:
             for item in ms.items:
                 all_dishes.append((normalize_dish_name(item), item, ms.eatery_name, bucket))
 
-    unique_names = list(set(d[0] for d in all_dishes))
+    # Menu order, not set order: keeps extraction batches stable between runs
+    unique_names = list(dict.fromkeys(d[0] for d in all_dishes))
     print(f"Total unique dishes: {len(unique_names)}")
 
     cached = db.get_dishes_batch(unique_names)
@@ -434,9 +976,11 @@ async def main() -> int:
     # Step 4: Extract attributes for uncached dishes + backfill cached dishes missing attributes
     uncached = [n for n in unique_names if not cached.get(n)]
     needs_attrs = [n for n in unique_names if cached.get(n) and not cached[n].get("flavor_profiles")]
-    to_extract = list(set(uncached + needs_attrs))
+    to_extract = uncached + needs_attrs  # disjoint, and both in menu order
 
-    if to_extract:
+    if to_extract and dry_run:
+        print(f"Dry run: skipping attribute extraction for {len(to_extract)} dishes.")
+    elif to_extract:
         label_parts = []
         if uncached:
             label_parts.append(f"{len(uncached)} new")
@@ -450,14 +994,13 @@ async def main() -> int:
             if norm not in name_map:
                 name_map[norm] = orig
 
-        originals = [name_map.get(n, n) for n in to_extract]
-        attrs_map = extract_dish_attributes_batch(originals)
+        norm_by_orig = {name_map.get(n, n): n for n in to_extract}
 
-        # Compute embeddings and store in Supabase
+        # Compute embeddings as each LLM batch lands (later batches are still
+        # in flight), then store in Supabase
         new_dishes: Dict[str, Dict] = {}
-        for norm_name in to_extract:
-            orig = name_map.get(norm_name, norm_name)
-            attrs = attrs_map.get(orig, {})
+        async for orig, attrs in iter_dish_attributes(list(norm_by_orig)):
+            norm_name = norm_by_orig[orig]
             ings = attrs.get("ingredients", [])
             vec = model.embed_ingredients(ings)
             new_dishes[norm_name] = {
@@ -471,8 +1014,9 @@ async def main() -> int:
                 "dish_type": attrs.get("dish_type", "main"),
             }
         db.upsert_dishes_batch(new_dishes)
-        # Re-fetch to get IDs assigned by the database
-        cached = db.get_dishes_batch(unique_names)
+        # Re-fetch only the upserted rows to pick up database-assigned IDs;
+        # everything else in cached is already current
+        cached.update(db.get_dishes_batch(list(new_dishes)))
         print(f"  Processed {len(new_dishes)} dishes.")
     else:
         print("All dishes already cached with attributes.")
@@ -480,27 +1024,24 @@ async def main() -> int:
     # Step 5: Store daily menu mapping (for rating links)
     # Build dish_id map from cached data
     menu_entries: List[Dict[str, Any]] = []
-    seen_combos: set = set()
-    for norm_name, orig_name, eatery, bucket in all_dishes:
+    for norm_name, eatery, bucket in dict.fromkeys((n, e, b) for n, _, e, b in all_dishes):
         dish_data = cached.get(norm_name)
         if not dish_data or "id" not in dish_data:
             continue
-        combo_key = (norm_name, eatery, bucket)
-        if combo_key in seen_combos:
-            continue
-        seen_combos.add(combo_key)
         menu_entries.append({
             "dish_id": dish_data["id"],
             "eatery": eatery,
             "bucket": bucket,
         })
-    db.upsert_daily_menu(date_str_iso, menu_entries)
+    if not dry_run:
+        db.upsert_daily_menu(date_str_iso, menu_entries)
 
     # Fetch daily menu lookup for rating links
     daily_menu_lookup = db.get_daily_menu_lookup(date_str_iso)
+    rating_link_table = build_rating_link_table(daily_menu_lookup, date_str_iso)
 
     # Step 6: Fetch subscribers and preferences
-    users = db.get_subscribed_users()
+    users = await users_task
     if not users:
         # Fallback to TO_EMAIL for bootstrapping
         to_emails = [
@@ -520,7 +1061,11 @@ async def main() -> int:
     else:
         print(f"Sending to {len(users)} subscriber(s).")
 
-    # Recompute stale preference vectors and track rating counts
+    # Recompute stale preference vectors and track rating counts (one paged
+    # query covers every user whose vector is still fresh)
+    rating_counts = db.get_rating_counts(
+        [u["id"] for u in users if u.get("id") and not u.get("vector_stale")]
+    )
     for user in users:
         if user.get("vector_stale") and user.get("id"):
             print(f"  Recomputing preference vector for {user['email']}...")
@@ -545,7 +1090,8 @@ async def main() -> int:
                 model,
             )
             user["preference_vector"] = new_vec
-            db.update_preference_vector(user["id"], new_vec)
+            if not dry_run:
+                db.update_preference_vector(user["id"], new_vec)
 
             inferred = infer_attribute_preferences(liked, disliked, cached)
             # Merge inferred rating signals with existing onboarding weights so that
@@ -558,12 +1104,13 @@ async def main() -> int:
                 all_keys = set(existing) | set(delta)
                 merged[key] = {k: existing.get(k, 0.0) + delta.get(k, 0.0) for k in all_keys}
             if any(merged.values()):
-                db.update_attribute_preferences(user["id"], **merged)
+                if not dry_run:
+                    db.update_attribute_preferences(user["id"], **merged)
                 user["flavor_weights"]  = merged["flavor_weights"]
                 user["method_weights"]  = merged["method_weights"]
                 user["cuisine_weights"] = merged["cuisine_weights"]
         elif user.get("id"):
-            user["_rating_count"] = db.get_user_rating_count(user["id"])
+            user["_rating_count"] = rating_counts[user["id"]]
 
     # Step 7: Generate per-user recommendations and send emails
     gmail_user = os.environ.get("GMAIL_USER", "").strip()
@@ -571,96 +1118,126 @@ async def main() -> int:
     hmac_secret = os.environ.get("HMAC_SECRET", "").strip()
     worker_url = os.environ.get("WORKER_BASE_URL", "").strip().rstrip("/")
 
-    if not gmail_user or not gmail_app_password:
+    if not dry_run and (not gmail_user or not gmail_app_password):
         raise RuntimeError("Missing env vars: GMAIL_USER, GMAIL_APP_PASSWORD")
 
-    # LLM fallback: precompute once for users without preferences
-    llm_result = None
-
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, timeout=30) as smtp:
-        smtp.login(gmail_user, gmail_app_password)
-
-        for user in users:
-            recipient = user["email"]
-            token = generate_unsub_token(recipient, hmac_secret) if hmac_secret else ""
-
-            # Build unsubscribe URL
-            unsub_url = ""
+    # Dish embeddings stacked once and handed to every email worker process.
+    # Workers score against the store, so the cache they get leaves out the
+    # per-dish embedding lists (300 boxed floats each) instead of shipping
+    # the same vectors twice
+    embedding_store = DishEmbeddingStore.from_dish_cache(cached)
+    worker_cache = {
+        n: {k: v for k, v in d.items() if k != "embedding"} if d else d
+        for n, d in cached.items()
+    }
+
+    loc_map = build_loc_map(menus)
+    tokens = generate_unsub_tokens([u["email"] for u in users], hmac_secret) if hmac_secret else {}
+    personalized = [u for u in users if u.get("preference_vector")]
+    fallback = [u for u in users if not u.get("preference_vector")]
+
+    # Producers build emails in worker processes and queue them; SMTP
+    # sessions send as soon as the first one is ready
+    outbox: "asyncio.Queue[Optional[Tuple[str, EmailMessage]]]" = asyncio.Queue()
+    sender = asyncio.create_task(
+        _log_outbox(outbox) if dry_run else send_emails(outbox, gmail_user, gmail_app_password)
+    )
+    # LLM fallback: computed once, in the background, for users without preferences
+    llm_task = (
+        asyncio.create_task(asyncio.to_thread(llm_fallback_result, menus, date_str_iso))
+        if fallback and not dry_run else None
+    )
+    # forkserver, not Linux's default fork: the sender task and the LLM and
+    # food2vec worker threads are already running, and forking a process with
+    # live threads can deadlock the children on locks those threads held
+    build_pool = (
+        ProcessPoolExecutor(
+            max_workers=min(EMAIL_BUILD_WORKERS, len(personalized)),
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_email_worker,
+            initargs=({
+                "local_dt": local_dt,
+                "menus": menus,
+                "cached": worker_cache,
+                "embedding_store": embedding_store,
+                "rating_link_table": rating_link_table,
+                "loc_map": loc_map,
+                "tokens": tokens,
+                "hmac_secret": hmac_secret,
+                "worker_url": worker_url,
+                "gmail_user": gmail_user,
+            },),
+        )
+        if personalized else None
+    )
+    loop = asyncio.get_running_loop()
+    build_failed: List[str] = []
+
+    async def produce(user: Dict[str, Any]) -> None:
+        # One user's failure is logged and skipped, like an SMTP reject, so
+        # everyone else's email still goes out; the run fails at the end
+        try:
+            item = await loop.run_in_executor(build_pool, _build_user_email, user)
+        except Exception as e:
+            print(f"WARNING: could not build email for {user['email']}: {e}", file=sys.stderr)
+            build_failed.append(user["email"])
+            return
+        outbox.put_nowait(item)
+
+    try:
+        await asyncio.gather(*(produce(u) for u in personalized))
+
+        if fallback:
+            llm_result = await llm_task if llm_task is not None else sanitize_result({}, menus)
             if hmac_secret and worker_url:
-                unsub_url = (
-                    f"{worker_url}/api/unsubscribe"
-                    f"?email={quote(recipient)}&token={token}"
+                # Same picks for everyone: render once with placeholder
+                # links, then fill in each recipient's email and token
+                subject, template = build_email(
+                    local_dt,
+                    llm_result,
+                    menus,
+                    unsubscribe_url=f"{worker_url}/api/unsubscribe?email={_EMAIL_SLOT}&token={_TOKEN_SLOT}",
+                    rating_base_url=worker_url,
+                    recipient_email=_EMAIL_SLOT,
+                    recipient_token=_TOKEN_SLOT,
+                    rating_link_table=rating_link_table,
+                    loc_map=loc_map,
                 )
-
-            # Check if user has preference vector
-            pref_vector = user.get("preference_vector")
-
-            if pref_vector:
-                # Embedding-based recommendation with hybrid scoring
-                result = generate_recommendations(
-                    pref_vector, menus, cached,
-                    flavor_weights=user.get("flavor_weights", {}),
-                    method_weights=user.get("method_weights", {}),
-                    cuisine_weights=user.get("cuisine_weights", {}),
-                    user_dietary=user.get("dietary_restrictions", []),
-                    rating_count=user.get("_rating_count", 0),
-                )
-                print(f"  {recipient}: embedding-based recommendation")
+                for user in fallback:
+                    recipient = user["email"]
+                    html = fill_email_template(template, recipient, tokens[recipient])
+                    print(f"  {recipient}: LLM fallback recommendation")
+                    outbox.put_nowait((recipient, _make_message(gmail_user, subject, html, recipient)))
             else:
-                # LLM fallback (computed once, shared for all no-pref users)
-                if llm_result is None:
-                    print("  Computing LLM fallback recommendation...")
-                    prompt = load_prompt()
-                    payload = {
-                        "date_local": date_str_iso,
-                        "timezone": "America/New_York",
-                        "campus_area_filter": "West",
-                        "meals": {
-                            k: [
-                                {
-                                    "eatery_name": ms.eatery_name,
-                                    "location": ms.location,
-                                    "event_descriptions": ms.event_descriptions,
-                                    "menu_summary": ms.menu_summary,
-                                    "categories": ms.categories,
-                                    "items": ms.items,
-                                }
-                                for ms in v
-                            ]
-                            for k, v in menus.items()
-                        },
-                    }
-                    llm_result = call_llm(prompt, payload)
-                    llm_result = sanitize_result(llm_result, menus)
-                result = llm_result
-                print(f"  {recipient}: LLM fallback recommendation")
-
-            # Build and send personalized email
-            subject, body = build_email(
-                local_dt,
-                result,
-                menus,
-                unsubscribe_url=unsub_url,
-                rating_base_url=worker_url,
-                recipient_email=recipient,
-                recipient_token=token,
-                daily_menu_lookup=daily_menu_lookup,
-                date_str_iso=date_str_iso,
-            )
-
-            msg = EmailMessage()
-            msg["Subject"] = subject
-            msg["From"] = gmail_user
-            msg["To"] = recipient
-            msg.set_content("View this email in an HTML-capable client.")
-            msg.add_alternative(body, subtype="html")
-
-            smtp.send_message(msg)
-            print(f"  → Sent to {recipient}")
-
-    print("All emails sent.")
+                # Unsubscribe and rating links need both the HMAC secret and
+                # the worker URL; without them the fallback email is the same
+                # for everyone: one BCC'd message per batch, to ourselves
+                subject, html = build_email(
+                    local_dt,
+                    llm_result,
+                    menus,
+                    rating_base_url=worker_url,
+                    rating_link_table=rating_link_table,
+                    loc_map=loc_map,
+                )
+                for i in range(0, len(fallback), BCC_BATCH_SIZE):
+                    batch = [u["email"] for u in fallback[i:i + BCC_BATCH_SIZE]]
+                    msg = _make_message(gmail_user, subject, html, gmail_user, bcc=batch)
+                    outbox.put_nowait((f"{len(batch)} fallback recipient(s) (BCC)", msg))
+    finally:
+        if build_pool is not None:
+            build_pool.shutdown(cancel_futures=True)
+        for _ in range(SMTP_CONNECTIONS):
+            outbox.put_nowait(None)
+        # Flush what's already queued even if building the rest failed
+        await sender
+    if build_failed:
+        raise RuntimeError(f"{len(build_failed)} email(s) not built: {', '.join(build_failed)}")
+
+    print("Dry run: no emails sent." if dry_run else "All emails sent.")
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(asyncio.run(main()))
+    run = uvloop.run if uvloop is not None else asyncio.run
+    raise SystemExit(run(main(dry_run="--dry-run" in sys.argv[1:])))
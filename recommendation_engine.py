@@ -1,11 +1,14 @@
 """Embedding-based recommendation engine using food2vec dish vectors."""
 
+import heapq
+from collections import defaultdict
 from dataclasses import dataclass
+from operator import itemgetter
 from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 
-from food_embeddings import EMBEDDING_DIM, FoodVectorModel, cosine_similarity
+from food_embeddings import EMBEDDING_DIM, DishEmbeddingStore, FoodVectorModel, normalize_dish_name
 
 
 @dataclass
@@ -16,6 +19,8 @@ class ScoredDish:
     score: float
 
 
+_by_score = itemgetter(1)  # sort key for (name, score, ...) tuples
+
 DECAY_FACTOR = 0.95
 INITIAL_WEIGHT = 1.0
 LIKED_WEIGHT = 0.5
@@ -27,6 +32,10 @@ METHOD_WEIGHT = 0.07
 CUISINE_WEIGHT = 0.10
 
 DISH_TYPE_MULTIPLIER = {"main": 1.0, "side": 0.6, "dessert": 0.7, "condiment": 0.0, "beverage": 0.4}
+# dish_type as an index into _TYPE_MULT; the extra last slot is any other type
+_TYPE_CODE = {t: i for i, t in enumerate(DISH_TYPE_MULTIPLIER)}
+_TYPE_MULT = np.array([*DISH_TYPE_MULTIPLIER.values(), 0.5])
+_CONDIMENT = _TYPE_CODE["condiment"]
 
 
 def _scoring_weights(rating_count: int) -> Tuple[float, float, float, float]:
@@ -44,29 +53,58 @@ def _scoring_weights(rating_count: int) -> Tuple[float, float, float, float]:
         return VECTOR_WEIGHT, CUISINE_WEIGHT, FLAVOR_WEIGHT, METHOD_WEIGHT
 
 
-def weighted_attr_score(user_weights: Dict[str, float], dish_attrs: List[str]) -> float:
+_DECAY_POWERS = np.power(DECAY_FACTOR, np.arange(512, dtype=np.float64))
+_DECAY_POWERS.flags.writeable = False
+
+
+def _decays(n: int) -> np.ndarray:
+    """[DECAY_FACTOR**0, ..., DECAY_FACTOR**(n-1)] for n most-recent-first
+    ratings: a read-only view of a table built once, grown if ever needed."""
+    global _DECAY_POWERS
+    if n > len(_DECAY_POWERS):
+        _DECAY_POWERS = np.power(DECAY_FACTOR, np.arange(2 * n, dtype=np.float64))
+        _DECAY_POWERS.flags.writeable = False
+    return _DECAY_POWERS[:n]
+
+
+def _positive_mass(user_weights: Dict[str, float]) -> float:
+    return sum(v for v in user_weights.values() if v > 0)
+
+
+def weighted_attr_score(
+    user_weights: Dict[str, float], dish_attrs: List[str], max_pos: Optional[float] = None
+) -> float:
     """Weighted attribute match, normalized to [0, 1].
 
     Sums user weights for each attribute present in the dish, then divides
     by the total positive weight mass. Negative weights clip to 0 in the result.
+    Pass max_pos (the positive mass of user_weights) when scoring many dishes.
     """
     if not user_weights or not dish_attrs:
         return 0.0
-    max_pos = sum(v for v in user_weights.values() if v > 0)
+    if max_pos is None:
+        max_pos = _positive_mass(user_weights)
     if max_pos == 0:
         return 0.0
     raw = sum(user_weights.get(attr, 0.0) for attr in dish_attrs)
     return max(0.0, raw) / max_pos
 
 
-def weighted_cuisine_score(user_weights: Dict[str, float], dish_cuisine: str) -> float:
-    """Cuisine preference score, normalized to [0, 1]."""
+def weighted_cuisine_score(
+    user_weights: Dict[str, float], dish_cuisine: str, max_pos: Optional[float] = None
+) -> float:
+    """Cuisine preference score, normalized to [0, 1].
+
+    dish_cuisine is expected lowercase, as stored by the extractor and
+    returned by SupabaseClient.get_dishes_batch.
+    """
     if not user_weights or not dish_cuisine or dish_cuisine == "other":
         return 0.0
-    max_pos = sum(v for v in user_weights.values() if v > 0)
+    if max_pos is None:
+        max_pos = _positive_mass(user_weights)
     if max_pos == 0:
         return 0.0
-    return max(0.0, user_weights.get(dish_cuisine.lower(), 0.0)) / max_pos
+    return max(0.0, user_weights.get(dish_cuisine, 0.0)) / max_pos
 
 
 def infer_attribute_preferences(
@@ -79,37 +117,26 @@ def infer_attribute_preferences(
     Liked signals add weight (decay × strength); disliked subtract at 0.5×.
     Returns dicts suitable for direct storage as JSONB.
     """
-    from collections import defaultdict
-
     flavor_scores: Dict[str, float] = defaultdict(float)
     method_scores: Dict[str, float] = defaultdict(float)
     cuisine_scores: Dict[str, float] = defaultdict(float)
 
-    for i, entry in enumerate(liked_dishes):
-        dish_data = dish_cache.get(entry.get("name", ""))
-        if not dish_data:
-            continue
-        w = (DECAY_FACTOR ** i) * entry.get("strength", 1.0)
-        for f in dish_data.get("flavor_profiles", []):
-            flavor_scores[f] += w
-        for m in dish_data.get("cooking_methods", []):
-            method_scores[m] += w
-        c = dish_data.get("cuisine_type", "other")
-        if c and c != "other":
-            cuisine_scores[c] += w
-
-    for i, entry in enumerate(disliked_dishes):
-        dish_data = dish_cache.get(entry.get("name", ""))
-        if not dish_data:
-            continue
-        w = (DECAY_FACTOR ** i) * entry.get("strength", 1.0)
-        for f in dish_data.get("flavor_profiles", []):
-            flavor_scores[f] -= w * 0.5
-        for m in dish_data.get("cooking_methods", []):
-            method_scores[m] -= w * 0.5
-        c = dish_data.get("cuisine_type", "other")
-        if c and c != "other":
-            cuisine_scores[c] -= w * 0.5
+    decays = _decays(max(len(liked_dishes), len(disliked_dishes))).tolist()
+
+    # One pass over both histories with a signed weight per side
+    for entries, sign in ((liked_dishes, 1.0), (disliked_dishes, -0.5)):
+        for i, entry in enumerate(entries):
+            dish_data = dish_cache.get(entry.get("name", ""))
+            if not dish_data:
+                continue
+            w = decays[i] * entry.get("strength", 1.0) * sign
+            for f in dish_data.get("flavor_profiles", []):
+                flavor_scores[f] += w
+            for m in dish_data.get("cooking_methods", []):
+                method_scores[m] += w
+            c = dish_data.get("cuisine_type", "other")
+            if c and c != "other":
+                cuisine_scores[c] += w
 
     return {
         "flavor_weights": dict(flavor_scores),
@@ -118,30 +145,71 @@ def infer_attribute_preferences(
     }
 
 
-def _is_dietary_compatible(dish_attrs: set, user_dietary: set) -> bool:
+# Dietary tags as bits. A vegan dish also sets the vegetarian bit; any other
+# tag sets _DIET_OTHER so "has attrs" still means mask != 0.
+_DIET_BITS = {
+    "vegetarian": 1,
+    "vegan": 2 | 1,
+    "gluten-free": 4,
+    "dairy-free": 8,
+    "halal": 16,
+    "contains-nuts": 32,
+    "contains-shellfish": 64,
+}
+_DIET_OTHER = 128
+# User restriction -> bits the dish must have / must not have
+_DIET_REQUIRED = {"vegetarian": 1, "vegan": 2, "gluten-free": 4, "dairy-free": 8, "halal": 16}
+_DIET_FORBIDDEN = {"no-nuts": 32, "no-shellfish": 64}
+
+
+def _dietary_masks(user_dietary: set) -> Tuple[int, int]:
+    """(required, forbidden) bitmasks for a user's restrictions."""
+    required = forbidden = 0
+    for restriction in user_dietary:
+        required |= _DIET_REQUIRED.get(restriction, 0)
+        forbidden |= _DIET_FORBIDDEN.get(restriction, 0)
+    return required, forbidden
+
+
+def _dish_diet_mask(dish_data: Dict) -> int:
+    """Bitmask of a cached dish's dietary_attrs, memoized on the dish dict
+    (every user's scoring pass reads it)."""
+    mask = dish_data.get("_diet_mask")
+    if mask is None:
+        mask = 0
+        for attr in dish_data.get("dietary_attrs", []):
+            mask |= _DIET_BITS.get(attr, _DIET_OTHER)
+        dish_data["_diet_mask"] = mask
+    return mask
+
+
+def _dish_ingredients(dish_data: Dict) -> frozenset:
+    """A cached dish's ingredients as a frozenset, memoized like _diet_mask."""
+    ings = dish_data.get("_ingredients_fs")
+    if ings is None:
+        ings = dish_data["_ingredients_fs"] = frozenset(dish_data.get("ingredients", []))
+    return ings
+
+
+def _dish_type_code(dish_data: Optional[Dict]) -> int:
+    """_TYPE_CODE of a cached dish's dish_type, memoized like _diet_mask.
+    Unknown dishes count as "main"."""
+    if not dish_data:
+        return _TYPE_CODE["main"]
+    code = dish_data.get("_type_code")
+    if code is None:
+        code = _TYPE_CODE.get(dish_data.get("dish_type", "main"), len(_TYPE_CODE))
+        dish_data["_type_code"] = code
+    return code
+
+
+def _is_dietary_compatible(dish_mask: int, required: int, forbidden: int) -> bool:
     """Return False if the dish conflicts with the user's dietary restrictions.
 
-    Only filters when the dish has non-empty dietary_attrs — unknown dishes
-    always pass through to avoid over-filtering.
+    Only filters when the dish has non-empty dietary_attrs (dish_mask != 0) —
+    unknown dishes always pass through to avoid over-filtering.
     """
-    if not dish_attrs or not user_dietary:
-        return True
-    for restriction in user_dietary:
-        if restriction == "vegetarian" and not (dish_attrs & {"vegetarian", "vegan"}):
-            return False
-        elif restriction == "vegan" and "vegan" not in dish_attrs:
-            return False
-        elif restriction == "gluten-free" and "gluten-free" not in dish_attrs:
-            return False
-        elif restriction == "dairy-free" and "dairy-free" not in dish_attrs:
-            return False
-        elif restriction == "halal" and "halal" not in dish_attrs:
-            return False
-        elif restriction == "no-nuts" and "contains-nuts" in dish_attrs:
-            return False
-        elif restriction == "no-shellfish" and "contains-shellfish" in dish_attrs:
-            return False
-    return True
+    return not dish_mask or (dish_mask & required == required and not dish_mask & forbidden)
 
 
 def jaccard_similarity(a: set, b: set) -> float:
@@ -153,6 +221,27 @@ def jaccard_similarity(a: set, b: set) -> float:
     return intersection / union if union > 0 else 0.0
 
 
+def _rated_rows(
+    entries: List[Dict], dish_cache: Dict[str, Optional[Dict]], scale: float
+) -> Tuple[List[List[float]], np.ndarray]:
+    """(embeddings, weights) for the entries that have an embedding (their
+    own, else the dish_cache one), weighted scale * strength_i * decay^i."""
+    rows: List[List[float]] = []
+    positions: List[int] = []
+    strengths: List[float] = []
+    for i, entry in enumerate(entries):
+        emb = entry.get("embedding")
+        if not emb:
+            dish_data = dish_cache.get(entry.get("name", ""))
+            emb = dish_data.get("embedding") if dish_data else None
+        if emb:
+            rows.append(emb)
+            positions.append(i)
+            strengths.append(entry.get("strength", 1.0))
+    weights = scale * np.asarray(strengths) * _decays(len(entries))[positions]
+    return rows, weights
+
+
 def compute_preference_vector(
     initial_ingredients: List[str],
     liked_dishes: List[Dict],
@@ -181,29 +270,14 @@ def compute_preference_vector(
             vec += INITIAL_WEIGHT * init_vec
             has_signal = True
 
-    # Liked dishes (positive signal)
-    for i, entry in enumerate(liked_dishes):
-        emb = entry.get("embedding")
-        if not emb:
-            dish_data = dish_cache.get(entry.get("name", ""))
-            emb = dish_data.get("embedding") if dish_data else None
-        if emb:
-            d_vec = np.array(emb, dtype=np.float32)
-            strength = entry.get("strength", 1.0)
-            vec += LIKED_WEIGHT * strength * (DECAY_FACTOR**i) * d_vec
-            has_signal = True
-
-    # Disliked dishes (negative signal)
-    for i, entry in enumerate(disliked_dishes):
-        emb = entry.get("embedding")
-        if not emb:
-            dish_data = dish_cache.get(entry.get("name", ""))
-            emb = dish_data.get("embedding") if dish_data else None
-        if emb:
-            d_vec = np.array(emb, dtype=np.float32)
-            strength = entry.get("strength", 1.0)
-            vec -= DISLIKED_WEIGHT * strength * (DECAY_FACTOR**i) * d_vec
-            has_signal = True
+    # Liked (positive) and disliked (negative) dishes: both histories are
+    # stacked with signed weights and summed in one GEMV
+    liked_rows, liked_w = _rated_rows(liked_dishes, dish_cache, LIKED_WEIGHT)
+    disliked_rows, disliked_w = _rated_rows(disliked_dishes, dish_cache, -DISLIKED_WEIGHT)
+    if liked_rows or disliked_rows:
+        weights = np.concatenate((liked_w, disliked_w)).astype(np.float32)
+        vec += weights @ np.asarray(liked_rows + disliked_rows, dtype=np.float32)
+        has_signal = True
 
     if not has_signal:
         return None
@@ -223,6 +297,7 @@ def generate_recommendations(
     cuisine_weights: Optional[Dict[str, float]] = None,
     user_dietary: Optional[List[str]] = None,
     rating_count: int = 0,
+    embedding_store: Optional[DishEmbeddingStore] = None,
 ) -> Dict[str, Any]:
     """Generate recommendations using hybrid scoring.
 
@@ -240,10 +315,15 @@ def generate_recommendations(
     preference vector more.
 
     Dishes incompatible with user_dietary restrictions are zeroed out
-    (only when the dish has non-empty dietary_attrs).
+    (only when the dish has non-empty dietary_attrs). Dishes with no
+    embedding and no attribute score are left out, as are eateries with
+    no remaining dishes.
 
     When no attribute weight dicts are provided, falls back to pure cosine similarity.
 
+    Pass a prebuilt embedding_store (from dish_cache) when scoring many users
+    against the same menu; otherwise one is built per call.
+
     Returns:
       {
         "breakfast_brunch": {"picks": [{"eatery": str, "dishes": [str, ...]}, ...]},
@@ -251,15 +331,18 @@ def generate_recommendations(
         "dinner": {"picks": [...]}
       }
     """
-    from food_embeddings import normalize_dish_name
-
     vec_w, cuisine_w, flavor_w, method_w = _scoring_weights(rating_count)
 
     fw = flavor_weights or {}
     mw = method_weights or {}
     cw = cuisine_weights or {}
-    dietary_set = set(user_dietary) if user_dietary else set()
+    diet_required, diet_forbidden = _dietary_masks(set(user_dietary) if user_dietary else set())
     has_attr_prefs = bool(fw or mw or cw)
+    # Normalizers are per user, not per dish
+    fw_mass, mw_mass, cw_mass = _positive_mass(fw), _positive_mass(mw), _positive_mass(cw)
+    store = embedding_store if embedding_store is not None else DishEmbeddingStore.from_dish_cache(dish_cache)
+    # One GEMV scores the preference vector against every cached dish
+    sims = store.similarities(preference_vector)
 
     result: Dict[str, Any] = {}
 
@@ -267,78 +350,96 @@ def generate_recommendations(
         # Score all dishes in this bucket
         eatery_dishes: Dict[str, List[Tuple[str, float]]] = {}
 
+        # Gather every item's cosine score for the bucket in one fancy-index;
+        # dishes without an embedding score 0
+        items = [item for ms in slices for item in ms.items]
+        norm_names = [normalize_dish_name(item) for item in items]
+        rows = store.rows_of(norm_names)
+        vec_scores = (
+            np.where(rows >= 0, sims[rows], 0.0).astype(np.float64)
+            if len(store) else np.zeros(len(rows))
+        )
+        # Raw item -> cached dish, resolved once for the scoring, variety and
+        # condiment passes below
+        dish_of = {item: dish_cache.get(n) for item, n in zip(items, norm_names)}
+
+        # Per-dish attribute scores and multipliers; the weighted combination
+        # is then one array expression over the bucket
+        attr_scores = np.zeros((len(items), 3))
+        has_attrs = np.zeros(len(items), dtype=bool)
+        compatible = np.ones(len(items), dtype=bool)
+        type_codes = np.zeros(len(items), dtype=np.intp)  # unknown dishes count as "main"
+        for k, item in enumerate(items):
+            dish_data = dish_of[item]
+            if not dish_data:
+                continue
+            if not _is_dietary_compatible(_dish_diet_mask(dish_data), diet_required, diet_forbidden):
+                compatible[k] = False
+                continue
+            if has_attr_prefs:
+                has_attrs[k] = True
+                attr_scores[k] = (
+                    weighted_attr_score(fw, dish_data.get("flavor_profiles", []), fw_mass),
+                    weighted_attr_score(mw, dish_data.get("cooking_methods", []), mw_mass),
+                    weighted_cuisine_score(cw, dish_data.get("cuisine_type", "other"), cw_mass),
+                )
+            type_codes[k] = _dish_type_code(dish_data)
+
+        combined = (
+            vec_w * vec_scores
+            + flavor_w * attr_scores[:, 0]
+            + method_w * attr_scores[:, 1]
+            + cuisine_w * attr_scores[:, 2]
+        )
+        scores = np.where(
+            compatible, np.where(has_attrs, combined, vec_scores) * _TYPE_MULT[type_codes], 0.0
+        ).tolist()
+        # Dishes with neither an embedding nor an attribute score carry no
+        # signal; keep them out of the ranking and the variety union
+        known = ((rows >= 0) | has_attrs).tolist()
+
+        k = 0
         for ms in slices:
-            scored: List[Tuple[str, float]] = []
-            for item in ms.items:
-                norm_name = normalize_dish_name(item)
-                dish_data = dish_cache.get(norm_name)
-
-                if dish_data and dish_data.get("embedding"):
-                    vec_score = cosine_similarity(
-                        preference_vector, dish_data["embedding"]
-                    )
-                else:
-                    vec_score = 0.0
-
-                dish_attrs = set(dish_data.get("dietary_attrs", [])) if dish_data else set()
-                if not _is_dietary_compatible(dish_attrs, dietary_set):
-                    scored.append((item, 0.0))
-                    continue
-
-                if has_attr_prefs and dish_data:
-                    flavor_score = weighted_attr_score(fw, dish_data.get("flavor_profiles", []))
-                    method_score = weighted_attr_score(mw, dish_data.get("cooking_methods", []))
-                    cuisine_score = weighted_cuisine_score(cw, dish_data.get("cuisine_type", "other"))
-
-                    score = (
-                        vec_w * vec_score
-                        + flavor_w * flavor_score
-                        + method_w * method_score
-                        + cuisine_w * cuisine_score
-                    )
-                else:
-                    score = vec_score
-
-                dish_type = dish_data.get("dish_type", "main") if dish_data else "main"
-                score *= DISH_TYPE_MULTIPLIER.get(dish_type, 0.5)
-
-                scored.append((item, score))
-
-            # Sort dishes by score descending
-            scored.sort(key=lambda x: x[1], reverse=True)
-            eatery_dishes[ms.eatery_name] = scored
+            n = len(ms.items)
+            dishes = [
+                (item, s)
+                for item, s, ok in zip(ms.items, scores[k:k + n], known[k:k + n])
+                if ok
+            ]
+            if dishes:
+                eatery_dishes[ms.eatery_name] = dishes
+            k += n
 
         # Compute eatery scores (mean of top 3 dish scores + ingredient variety bonus)
         eatery_scores: List[Tuple[str, float, List[Tuple[str, float]]]] = []
         for eatery, dishes in eatery_dishes.items():
-            top3 = dishes[:3]
+            # Only the best few dishes and eateries are used, so take them
+            # with nlargest (same order as a stable descending sort)
+            top3 = heapq.nlargest(3, dishes, key=_by_score)
             if top3:
                 avg_score = sum(s for _, s in top3) / len(top3)
             else:
                 avg_score = 0.0
 
             # Ingredient variety: count unique ingredients across all dishes
-            all_ings: set = set()
-            for dish_name, _ in dishes:
-                norm = normalize_dish_name(dish_name)
-                dd = dish_cache.get(norm)
-                if dd:
-                    all_ings.update(dd.get("ingredients", []))
+            all_ings = frozenset().union(
+                *(_dish_ingredients(dd) for dd in (dish_of[n] for n, _ in dishes) if dd)
+            )
             # Scale: 0 ings → 0.0, 10+ ings → 1.0
             variety_bonus = min(len(all_ings) / 10.0, 1.0)
             eatery_score = 0.85 * avg_score + 0.15 * variety_bonus
 
             eatery_scores.append((eatery, eatery_score, dishes))
 
-        # Sort eateries by score, take top 4
-        eatery_scores.sort(key=lambda x: x[1], reverse=True)
+        # Top 4 eateries by score, each with its top 5 non-condiment dishes
         picks = []
-        for eatery, _, dishes in eatery_scores[:4]:
-            top_dishes = [
-                name for name, _ in dishes
-                if (dish_cache.get(normalize_dish_name(name)) or {}).get("dish_type") != "condiment"
-            ][:5]
-            picks.append({"eatery": eatery, "dishes": top_dishes})
+        for eatery, _, dishes in heapq.nlargest(4, eatery_scores, key=_by_score):
+            top_dishes = heapq.nlargest(
+                5,
+                (d for d in dishes if _dish_type_code(dish_of[d[0]]) != _CONDIMENT),
+                key=_by_score,
+            )
+            picks.append({"eatery": eatery, "dishes": [name for name, _ in top_dishes]})
 
         result[bucket] = {"picks": picks}
 
@@ -43,9 +43,7 @@ def main() -> int:
     for row in rows:
         vec = db._vector_to_list(row.get("embedding"))
         if vec and len(vec) == 300:
-            valid.append(
-                (row["id"], row["source_name"], np.array(vec, dtype=np.float32))
-            )
+            valid.append((row["id"], row["source_name"], vec))
 
     if len(valid) < 10:
         print(
@@ -60,61 +58,55 @@ def main() -> int:
     # Normalize all vectors to unit length
     ids = [v[0] for v in valid]
     names = [v[1] for v in valid]
-    matrix = np.stack([v[2] for v in valid])  # shape: (N, 300)
+    # One C-contiguous float32 array, so each step below is a single SGEMV
+    matrix = np.asarray([v[2] for v in valid], dtype=np.float32)  # shape: (N, 300)
     norms = np.linalg.norm(matrix, axis=1, keepdims=True)
-    norms = np.where(norms == 0, 1.0, norms)
-    matrix = matrix / norms
+    matrix /= np.where(norms == 0, 1.0, norms)
 
     # Greedy farthest-point selection
     # Start with dish 0, then each step pick the dish that maximizes
     # minimum cosine distance to all already-selected dishes.
     # cosine distance = 1 - cosine_similarity (since vectors are normalized: sim = dot product)
-    N = len(valid)
     selected_indices = [0]
-    # min_dist[i] = min cosine distance from dish i to any selected dish
+    # min_dist[i] = min cosine distance from dish i to any selected dish;
+    # selected dishes sit at -inf, which the minimum update keeps
     sim_to_first = matrix @ matrix[0]  # shape: (N,)
     min_dist = 1.0 - sim_to_first
+    min_dist[0] = -np.inf
 
     for _ in range(9):
         # Pick the dish with the largest min distance
-        # Mask already-selected
-        for idx in selected_indices:
-            min_dist[idx] = -1.0
         next_idx = int(np.argmax(min_dist))
         selected_indices.append(next_idx)
-        # Update min distances
-        sim_to_new = matrix @ matrix[next_idx]
-        dist_to_new = 1.0 - sim_to_new
-        min_dist = np.minimum(min_dist, dist_to_new)
+        # Update min distances in place
+        np.minimum(min_dist, 1.0 - matrix @ matrix[next_idx], out=min_dist)
+        min_dist[next_idx] = -np.inf
 
-    selected_ids = {ids[i] for i in selected_indices}
-    all_ids = set(ids)
+    selected_ids = [ids[i] for i in selected_indices]
 
     print("Selected dishes:")
     for i in selected_indices:
         print(f"  [{ids[i]}] {names[i]}")
 
-    # Update is_onboarding_dish flags
+    # Update is_onboarding_dish flags: two filtered updates, one round-trip
+    # each. A PATCH never writes the GENERATED ALWAYS id (only upserts do).
     print("\nUpdating database...")
 
-    # Set TRUE for selected (one update per dish — avoids GENERATED ALWAYS identity issue)
-    for did in selected_ids:
-        db.client.table("dishes").update({"is_onboarding_dish": True}).eq(
-            "id", did
-        ).execute()
-
-    # Set FALSE for non-selected (batch update)
-    non_selected_ids = list(all_ids - selected_ids)
-    if non_selected_ids:
-        batch_size = 100
-        for start in range(0, len(non_selected_ids), batch_size):
-            batch = non_selected_ids[start : start + batch_size]
-            db.client.table("dishes").update({"is_onboarding_dish": False}).in_(
-                "id", batch
-            ).execute()
+    db.client.table("dishes").update({"is_onboarding_dish": True}).in_(
+        "id", selected_ids
+    ).execute()
+
+    # Clear every other dish still flagged from a previous selection
+    cleared = (
+        db.client.table("dishes")
+        .update({"is_onboarding_dish": False})
+        .eq("is_onboarding_dish", True)
+        .not_.in_("id", selected_ids)
+        .execute()
+    )
 
     print(
-        f"Done. {len(selected_ids)} onboarding dishes marked, {len(non_selected_ids)} cleared."
+        f"Done. {len(selected_ids)} onboarding dishes marked, {len(cleared.data or [])} cleared."
     )
     return 0
 
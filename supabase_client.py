@@ -8,8 +8,28 @@ import os
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
+import numpy as np
 from supabase import Client, create_client
 
+try:  # pgvector columns come back as "[0.1,...]" text, 300 floats per dish
+    import orjson
+
+    _json_loads = orjson.loads
+    _JSONDecodeError = orjson.JSONDecodeError
+
+    def _f32_array_text(arr: np.ndarray) -> str:
+        return orjson.dumps(arr, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+except ImportError:  # orjson is an optional speedup
+    _json_loads = json.loads
+    _JSONDecodeError = json.JSONDecodeError
+
+    def _f32_array_text(arr: np.ndarray) -> str:
+        return json.dumps(arr.tolist())
+
+
+RATINGS_PAGE_SIZE = 1000  # PostgREST's default max-rows per response
+USER_ID_CHUNK_SIZE = 100  # ids per in_() filter, keeps request URLs short
+
 
 class SupabaseClient:
     """Read/write dishes, user preferences, ratings, and daily menus."""
@@ -34,21 +54,38 @@ class SupabaseClient:
             if not value:
                 return None
             try:
-                parsed = json.loads(value)
-            except json.JSONDecodeError:
+                parsed = _json_loads(value)
+            except _JSONDecodeError:
+                return None
+            # pgvector text is a flat numeric array, so the decoder has
+            # already produced Python numbers; re-boxing each of the 300
+            # elements through float() was a third of the decode time. A type
+            # check is much cheaper and still rejects nulls and strings.
+            if isinstance(parsed, list):
+                if all(type(x) in (float, int) for x in parsed):
+                    return parsed
                 return None
         if hasattr(parsed, "tolist"):
             parsed = parsed.tolist()
         if isinstance(parsed, (list, tuple)):
-            floats: List[float] = []
-            for item in parsed:
-                try:
-                    floats.append(float(item))
-                except (TypeError, ValueError):
-                    return None
-            return floats
+            try:
+                return [float(item) for item in parsed]
+            except (TypeError, ValueError):
+                return None
         return None
 
+    @staticmethod
+    def _list_to_vector(value: Optional[List[float]]) -> Optional[str]:
+        """Encode an embedding as pgvector text for writes.
+
+        pgvector stores float4, so orjson's shortest float32 repr round-trips
+        exactly and is about half the JSON of the float64 digits a plain
+        list would be sent as.
+        """
+        if value is None:
+            return None
+        return _f32_array_text(np.asarray(value, dtype=np.float32))
+
     # ─── Dishes ──────────────────────────────────────────────────────────
 
     def get_dishes_batch(
@@ -78,7 +115,8 @@ class SupabaseClient:
                 "source_name": row["source_name"],
                 "flavor_profiles": row.get("flavor_profiles", []),
                 "cooking_methods": row.get("cooking_methods", []),
-                "cuisine_type": row.get("cuisine_type", "other"),
+                # Lowercased once here so scoring can key user weights directly
+                "cuisine_type": (row.get("cuisine_type") or "other").lower(),
                 "dietary_attrs": row.get("dietary_attrs", []),
                 "dish_type": row.get("dish_type", "main"),
             }
@@ -101,7 +139,7 @@ class SupabaseClient:
                     "normalized_name": norm_name,
                     "source_name": data.get("source_name", norm_name),
                     "ingredients": data.get("ingredients", []),
-                    "embedding": data.get("embedding"),
+                    "embedding": self._list_to_vector(data.get("embedding")),
                     "flavor_profiles": data.get("flavor_profiles", []),
                     "cooking_methods": data.get("cooking_methods", []),
                     "cuisine_type": data.get("cuisine_type", "other"),
@@ -195,6 +233,35 @@ class SupabaseClient:
         )
         return resp.count or 0
 
+    def get_rating_counts(self, user_ids: List[str]) -> Dict[str, int]:
+        """Return {user_id: rating count} for many users.
+
+        Pages through the matching rating rows (user_id only) instead of
+        issuing one count request per user, USER_ID_CHUNK_SIZE users at a time.
+        """
+        counts = dict.fromkeys(user_ids, 0)
+        for i in range(0, len(user_ids), USER_ID_CHUNK_SIZE):
+            chunk = user_ids[i:i + USER_ID_CHUNK_SIZE]
+            start = 0
+            while True:
+                resp = (
+                    self.client.table("ratings")
+                    .select("user_id")
+                    .in_("user_id", chunk)
+                    .order("id")
+                    .range(start, start + RATINGS_PAGE_SIZE - 1)
+                    .execute()
+                )
+                rows = resp.data or []
+                for row in rows:
+                    counts[row["user_id"]] += 1
+                # The server's max-rows cap equals RATINGS_PAGE_SIZE, so a
+                # short page is the last one
+                if len(rows) < RATINGS_PAGE_SIZE:
+                    break
+                start += len(rows)
+        return counts
+
     # ─── Ratings ─────────────────────────────────────────────────────────
 
     def get_user_ratings(self, user_id: str) -> List[Dict[str, Any]]:
@@ -237,7 +304,7 @@ class SupabaseClient:
         self.client.table("user_preferences").upsert(
             {
                 "user_id": user_id,
-                "preference_vector": vector,
+                "preference_vector": self._list_to_vector(vector),
                 "vector_stale": False,
                 "updated_at": datetime.utcnow().isoformat() + "Z",
             },
@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from food_embeddings import normalize_dish_name
+from ingredient_extractor import RULES, SYSTEM_PROMPT, _parse_response, _validate_attrs
+
+
+def _prompt_examples():
+    """The example output object embedded in SYSTEM_PROMPT."""
+    start = SYSTEM_PROMPT.index("Example output:") + len("Example output:")
+    end = SYSTEM_PROMPT.index("Return ONLY")
+    return _parse_response(json.loads(SYSTEM_PROMPT[start:end]))
+
+
+class RuleTableTest(unittest.TestCase):
+    def test_rules_match_prompt_examples(self):
+        matched = 0
+        for name, attrs in _prompt_examples().items():
+            rule = RULES.get(normalize_dish_name(name))
+            if rule is None:
+                continue
+            matched += 1
+            self.assertEqual(rule, _validate_attrs(attrs), name)
+        self.assertGreater(matched, 0)
+
+    def test_fried_rules_make_no_gluten_free_or_halal_claim(self):
+        for name, rule in RULES.items():
+            if "fried" in rule["cooking_methods"]:
+                self.assertFalse({"gluten-free", "halal"} & set(rule["dietary_attrs"]), name)
+
+    def test_variable_recipes_make_no_plant_or_allergen_free_claim(self):
+        # Toast is often buttered, bagels may contain egg or honey, and BBQ
+        # sauce may contain malt vinegar or Worcestershire
+        unsafe = {"vegan", "dairy-free", "gluten-free", "halal"}
+        for name in ("toast", "bagels", "oatmeal", "pita", "bbq sauce", "barbecue sauce"):
+            self.assertFalse(unsafe & set(RULES[name]["dietary_attrs"]), name)
+        self.assertEqual(RULES["bbq sauce"]["dietary_attrs"], [])
+
+
+class ParseResponseTest(unittest.TestCase):
+    def test_dish_list_is_keyed_by_name(self):
+        parsed = _parse_response({"dishes": [{"name": "Rice", "dish_type": "side"}, {"dish_type": "main"}]})
+        self.assertEqual(parsed, {"Rice": {"name": "Rice", "dish_type": "side"}})
+
+    def test_name_keyed_object_passes_through(self):
+        self.assertEqual(_parse_response({"Rice": {"dish_type": "side"}}), {"Rice": {"dish_type": "side"}})
+
+
+if __name__ == "__main__":
+    unittest.main()